@@ -1,14 +1,32 @@
+import os
 import numpy as np
-from functions import integral
+import instrumentation
+import metrics
+from functions import integral, storage
 
 
-def RungeKutta(f, g, t, x_0, y_0):
+class Cancelled(Exception):
+    # raised from a progress callback to stop an integration
+    pass
+
+
+def RungeKutta(f, g, t, x_0, y_0, progress=None, start=None, checkpoint=None, checkpoint_every=None):
+    # progress, if given, is called with the done fraction after every
+    # chunk of steps; it may raise Cancelled. start = (x, y) on the first
+    # nodes of t continues an earlier run from its last node instead of t[0];
+    # checkpoint(i, x, y) is called every checkpoint_every steps with the
+    # arrays filled up to node i.
+    chunk = max(1, (len(t) - 1) // 100)
     x = np.zeros(len(t))
     x[0] = x_0
     y = np.zeros(len(t))
     y[0] = y_0
+    first = 0
+    if start is not None:
+        first = len(start[0]) - 1
+        x[:first + 1], y[:first + 1] = start
     
-    for i in range(0, len(t) - 1):
+    for i in range(first, len(t) - 1):
         h = t[i + 1] - t[i]
         k0 = f(t[i], x[i], y[i]) * h
         q0 = g(t[i], x[i], y[i]) * h
@@ -25,59 +43,359 @@ def RungeKutta(f, g, t, x_0, y_0):
         
         x[i + 1] = x[i] + (k0 + 2 * k1 + 2 * k2 + k3) / 6
         y[i + 1] = y[i] + (q0 + 2 * q1 + 2 * q2 + q3) / 6
+
+        if progress is not None and (i + 1) % chunk == 0:
+            progress((i + 1) / (len(t) - 1))
+        if checkpoint is not None and (i + 1) % checkpoint_every == 0:
+            checkpoint(i + 1, x, y)
     
     return x, y
 
 
-def solve(x_0, y_0, beta, T, N, p_func, z_func, s_func, u_func, f_func):
-    t_range = np.arange(0, T + T/N, T/N)
+def RungeKuttaBatch(f, g, t, x_0, y_0):
+    # Same scheme as RungeKutta for M trajectories at once: f and g take
+    # (t, x, y) with x, y of shape (M,) and return arrays of that shape.
+    x_0, y_0 = np.broadcast_arrays(np.asarray(x_0, dtype=float), np.asarray(y_0, dtype=float))
+    x = np.zeros((len(x_0), len(t)))
+    x[:, 0] = x_0
+    y = np.zeros((len(y_0), len(t)))
+    y[:, 0] = y_0
 
-    def f_function(t, x, y):
-        if t == T:
-            derived_z_i = (z_func.calculate(t) - z_func.calculate(t - 1/(N * 10))) * N * 10
+    for i in range(0, len(t) - 1):
+        h = t[i + 1] - t[i]
+        x_i, y_i = x[:, i], y[:, i]
+        k0 = f(t[i], x_i, y_i) * h
+        q0 = g(t[i], x_i, y_i) * h
+
+        k1 = f(t[i] + h / 2, x_i + k0 / 2, y_i + q0 / 2) * h
+        q1 = g(t[i] + h / 2, x_i + k0 / 2, y_i + q0 / 2) * h
+
+        k2 = f(t[i] + h / 2, x_i + k1 / 2, y_i + q1 / 2) * h
+        q2 = g(t[i] + h / 2, x_i + k1 / 2, y_i + q1 / 2) * h
+
+        k3 = f(t[i] + h, x_i + k2, y_i + q2) * h
+        q3 = g(t[i] + h, x_i + k2, y_i + q2) * h
+
+        x[:, i + 1] = x_i + (k0 + 2 * k1 + 2 * k2 + k3) / 6
+        y[:, i + 1] = y_i + (q0 + 2 * q1 + 2 * q2 + q3) / 6
+
+    return x, y
+
+
+# Dormand-Prince 5(4) tableau
+DP_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+DP_A = [[],
+        [1/5],
+        [3/40, 9/40],
+        [44/45, -56/15, 32/9],
+        [19372/6561, -25360/2187, 64448/6561, -212/729],
+        [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+        [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]]
+DP_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+DP_E = np.array([71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40])
+
+
+def DormandPrince(f, g, T, x_0, y_0, rtol=1e-6, atol=1e-9, h=None, max_steps=100000, progress=None):
+    # Adaptive embedded RK45 on [0, T]. The last stage is the derivative at
+    # the new point (FSAL), which also feeds the dense output.
+    def rhs(t, u):
+        return np.array([f(t, u[0], u[1]), g(t, u[0], u[1])])
+
+    t = 0.0
+    u = np.array([x_0, y_0], dtype=float)
+    k = np.zeros((7, 2))
+    k[0] = rhs(t, u)
+    h = T / 100 if h is None else h
+    t_points, u_points, du_points = [t], [u], [k[0].copy()]
+    stats = {"accepted": 0, "rejected": 0, "evaluations": 1}
+
+    while t < T:
+        if stats["accepted"] + stats["rejected"] >= max_steps:
+            raise RuntimeError("DormandPrince: too many steps")
+        h = min(h, T - t)
+        for i in range(1, 7):
+            k[i] = rhs(t + DP_C[i] * h, u + h * np.dot(DP_A[i], k[:i]))
+        stats["evaluations"] += 6
+        u_new = u + h * np.dot(DP_B, k)
+        scale = atol + rtol * np.maximum(np.abs(u), np.abs(u_new))
+        error = np.sqrt(np.mean((h * np.dot(DP_E, k) / scale) ** 2))
+
+        if error <= 1:
+            t = T if T - t - h <= 1e-12 * T else t + h
+            u = u_new
+            k[0] = k[6]
+            t_points.append(t)
+            u_points.append(u)
+            du_points.append(k[0].copy())
+            stats["accepted"] += 1
+            if progress is not None:
+                progress(t / T)
+            factor = 10 if error == 0 else min(10, 0.9 * error ** -0.2)
         else:
-            derived_z_i = (z_func.calculate(t + 1/(N * 10)) - z_func.calculate(t)) * N * 10
-        return derived_z_i * u_func.calculate(y)
+            stats["rejected"] += 1
+            factor = max(0.2, 0.9 * error ** -0.2)
+        h *= factor
+
+    u_points, du_points = np.array(u_points), np.array(du_points)
+    return Solution(np.array(t_points), u_points[:, 0], u_points[:, 1],
+                    du_points[:, 0], du_points[:, 1], stats)
+
+
+class Solution():
+
+    # Trajectory on the accepted grid with a cubic Hermite interpolant built
+    # from the values and the derivatives at the grid points.
+    def __init__(self, t, x, y, dx, dy, stats=None):
+        self.t = t
+        self.x = x
+        self.y = y
+        self.dx = dx
+        self.dy = dy
+        self.stats = stats
+
+    def interpolate(self, values, derivatives, ts, derivative):
+        i = np.clip(np.searchsorted(self.t, ts) - 1, 0, len(self.t) - 2)
+        h = self.t[i + 1] - self.t[i]
+        s = (ts - self.t[i]) / h
+        v0, v1 = values[i], values[i + 1]
+        d0, d1 = derivatives[i] * h, derivatives[i + 1] * h
+        if derivative:
+            return ((6 * s ** 2 - 6 * s) * (v0 - v1) + (3 * s ** 2 - 4 * s + 1) * d0
+                    + (3 * s ** 2 - 2 * s) * d1) / h
+        return ((2 * s ** 3 - 3 * s ** 2 + 1) * v0 + (-2 * s ** 3 + 3 * s ** 2) * v1
+                + (s ** 3 - 2 * s ** 2 + s) * d0 + (s ** 3 - s ** 2) * d1)
+
+    def calculate_many(self, ts, derivative=False):
+        ts = np.asarray(ts, dtype=float)
+        return (self.interpolate(self.x, self.dx, ts, derivative),
+                self.interpolate(self.y, self.dy, ts, derivative))
+
+    def calculate(self, t, derivative=False):
+        x, y = self.calculate_many(t, derivative)
+        return float(x), float(y)
+
+    def head(self, count):
+        # the first `count` nodes, e.g. to resume an integration from there
+        dx = self.dx[:count] if self.dx is not None else None
+        dy = self.dy[:count] if self.dy is not None else None
+        return Solution(self.t[:count], self.x[:count], self.y[:count], dx, dy)
+
+    def save(self, path):
+        # written to a temporary file first, so an interrupted save leaves the
+        # previous checkpoint intact
+        arrays = {"t": self.t, "x": self.x, "y": self.y}
+        if self.dx is not None:
+            arrays.update(dx=self.dx, dy=self.dy)
+        temporary = path + ".tmp"
+        with open(temporary, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            dx = data["dx"] if "dx" in data.files else None
+            dy = data["dy"] if "dy" in data.files else None
+            return cls(data["t"], data["x"], data["y"], dx, dy)
+
+
+def node_derivatives(f, g, t_range, x, y):
+    dx = np.array([f(t_range[i], x[i], y[i]) for i in range(len(t_range))])
+    dy = np.array([g(t_range[i], x[i], y[i]) for i in range(len(t_range))])
+    return dx, dy
+
+
+class FiniteDifference():
+
+    # one-sided difference for z functions without an analytic derivative
+    def __init__(self, func, T, N):
+        self.func = func
+        self.T = T
+        self.N = N
+
+    def calculate(self, t):
+        N, z_func = self.N, self.func
+        if t == self.T:
+            return (z_func.calculate(t) - z_func.calculate(t - 1/(N * 10))) * N * 10
+        return (z_func.calculate(t + 1/(N * 10)) - z_func.calculate(t)) * N * 10
+
+
+def z_derivative(z_func, T, N):
+    if hasattr(z_func, "derivative"):
+        return z_func.derivative()
+    return FiniteDifference(z_func, T, N)
+
+
+def function_values(func, points):
+    if hasattr(func, "calculate_many"):
+        return func.calculate_many(points)
+    return np.array([func.calculate(point) for point in points])
+
+
+def unchanged_steps(solution, old_inputs, new_inputs, rtol=1e-12):
+    # Number of leading RK steps of solution that the new inputs reproduce.
+    # inputs = (beta, z', s, u); step i reads z' and s at t_i, t_i + h/2,
+    # t_{i+1} and u at the y of those points, so it is kept when they all
+    # agree there. Any change of beta invalidates everything.
+    if old_inputs[0] != new_inputs[0]:
+        return 0
+    t = solution.t
+    points = np.empty(2 * len(t) - 1)
+    points[0::2] = t
+    points[1::2] = (t[1:] + t[:-1]) / 2
+    ys = solution.calculate_many(points)[1]
+    agree = np.ones(len(points), dtype=bool)
+    for old, new, where in zip(old_inputs[1:], new_inputs[1:], (points, points, ys)):
+        before, after = function_values(old, where), function_values(new, where)
+        agree &= np.abs(after - before) <= rtol * np.maximum(1.0, np.abs(before))
+    # a step needs its start, its middle and its end
+    steps = agree[0:-1:2] & agree[1::2] & agree[2::2]
+    return len(steps) if steps.all() else int(np.argmin(steps))
+
+
+def solve(x_0, y_0, beta, T, N, p_func, z_func, s_func, u_func, f_func,
+          method="rk4", rtol=1e-6, atol=1e-9, return_solution=False, export=False, inner=None, progress=None,
+          resume=None, checkpoint=None, checkpoint_every=None):
+    # method "rk4" integrates on the fixed grid of N steps, "rk45" chooses
+    # the steps itself to keep the local error within rtol/atol.
+    # rk4 only: resume is a Solution on the first nodes of the same grid to
+    # continue from; checkpoint is a file the partial trajectory is saved to
+    # every checkpoint_every steps (N // 10 by default), see Solution.load.
+    t_range = np.linspace(0, T, N + 1)
+    start = None
+    if resume is not None:
+        count = len(resume.t)
+        if method != "rk4" or count > len(t_range) or not np.allclose(resume.t, t_range[:count], rtol=1e-12, atol=0):
+            raise ValueError("The solution to resume is not on the rk4 grid of this solve")
+        start = (resume.x, resume.y)
+    save = None
+    if checkpoint is not None:
+        checkpoint_every = checkpoint_every or max(1, N // 10)
+        save = lambda i, x, y: Solution(t_range[:i + 1], x[:i + 1], y[:i + 1], None, None).save(checkpoint)
+
+    derived_z = z_derivative(z_func, T, N)
+    instrumentation.label(derived_z, "z'")
+
+    def f_function(t, x, y):
+        return derived_z.calculate(t) * u_func.calculate(y)
     
     def g_function(t, x, y):
         return f_func.calculate(t, x)
-    
-    x_ans, y_ans = RungeKutta(f_function, g_function, t_range, x_0, y_0)
-    print_solution(x_ans, y_ans, t_range)
-    c2 = np.abs(x_ans[-1] - s_func.calculate(T)) / s_func.calculate(T)
-
-    class C1Integrand2():
-        def __init__(self):
-            pass
-
-        def calculate(w):
-            return w * p_func.calculate(w)
-
-    c1_integral_of_integrand = integral.Integral(C1Integrand2())
-
-    class C1Integrand():
-        def __init__(self, params):
-            self.params = params
-
-        def calculate(t):
-            # x'(t)
-            i = np.searchsorted(t_range, t)
-            if t_range[i] < t or i == len(t_range) - 1:
-                i -= 1
-            derived_x = (x_ans[i + 1] - x_ans[i]) / (t_range[i + 1] - t_range[i])
-            if t == t_range[i]:
-                return derived_x * self.params.calculate(y_ans[i])
-            return derived_x * self.params.calculate((y_ans[t] + y_ans[t + 1]) / 2)
-
-    c1_integral = integral.Integral(C1Integrand(c1_integral_of_integrand))
-    c1 =  1 - c1_integral.calculate(0) / (x_ans[-1] - x_ans[0])
+
+    with instrumentation.span("integrate"):
+        if method == "rk4":
+            x_ans, y_ans = RungeKutta(f_function, g_function, t_range, x_0, y_0, progress,
+                                      start, save, checkpoint_every)
+            dx, dy = node_derivatives(f_function, g_function, t_range, x_ans, y_ans)
+            # four stages per step and one more evaluation per node for the dense output
+            steps = len(t_range) - (len(start[0]) if start is not None else 1)
+            stats = {"accepted": steps, "rejected": 0, "evaluations": 4 * steps + len(t_range),
+                     "resumed_at": T * (len(t_range) - 1 - steps) / N}
+            solution = Solution(t_range, x_ans, y_ans, dx, dy, stats)
+        elif method == "rk45":
+            solution = DormandPrince(f_function, g_function, T, x_0, y_0, rtol, atol, T / N, progress=progress)
+        else:
+            raise ValueError("Unknown method: {}".format(method))
+
+    if export:
+        print_solution(solution.x, solution.y, solution.t)
+    with instrumentation.span("criteria"):
+        c1, c2 = criteria(solution, T, p_func, s_func, inner)
+    if return_solution:
+        return c1, c2, solution
     return c1, c2
 
 
-def print_solution(x, y, t_range):
-    with open("x_answer.txt", 'w') as output_file:
+def solve_many(x_0, y_0, beta, T, N, p_func, z_func, s_func, u_func, f_func):
+    # beta, x_0 and y_0 may be arrays of shape (M,); f_func must be built with
+    # the same beta so that its calculate broadcasts over the trajectories.
+    t_range = np.linspace(0, T, N + 1)
+    x_0, y_0, beta = np.broadcast_arrays(np.atleast_1d(np.asarray(x_0, dtype=float)),
+                                         np.asarray(y_0, dtype=float), np.asarray(beta, dtype=float))
+
+    derived_z = z_derivative(z_func, T, N)
+
+    def f_function(t, x, y):
+        return derived_z.calculate(t) * u_func.calculate_many(y)
+
+    def g_function(t, x, y):
+        return f_func.calculate(t, x)
+
+    x_ans, y_ans = RungeKuttaBatch(f_function, g_function, t_range, x_0, y_0)
+    dx, dy = node_derivatives(f_function, g_function, t_range, x_ans.T, y_ans.T)
+    inner = metrics.inner_integral(p_func)
+    c = [criteria(Solution(t_range, x_ans[k], y_ans[k], dx[:, k], dy[:, k]), T, p_func, s_func, inner)
+         for k in range(len(x_ans))]
+    c1, c2 = np.array(c).T
+    return c1, c2, x_ans, y_ans
+
+
+def RungeKuttaSystem(F, t, u_0):
+    # classic RK4 for a vector state u' = F(t, u)
+    u = np.zeros((len(t), len(u_0)))
+    u[0] = u_0
+    for i in range(0, len(t) - 1):
+        h = t[i + 1] - t[i]
+        k0 = F(t[i], u[i]) * h
+        k1 = F(t[i] + h / 2, u[i] + k0 / 2) * h
+        k2 = F(t[i] + h / 2, u[i] + k1 / 2) * h
+        k3 = F(t[i] + h, u[i] + k2) * h
+        u[i + 1] = u[i] + (k0 + 2 * k1 + 2 * k2 + k3) / 6
+    return u
+
+
+def solve_sensitivity(x_0, y_0, beta, T, N, p_func, z_func, s_func, u_func,
+                      dp_func=None, dz_func=None, ds_func=None, dbeta=1.0, inner=None):
+    # Integrates x, y together with X = dx/dtheta, Y = dy/dtheta for one
+    # parameter theta. dp_func, dz_func, ds_func are dp/dtheta, dz/dtheta,
+    # ds/dtheta (None for zero) and dbeta = dbeta/dtheta:
+    #   X' = z'(t) u'(y) Y + dz'(t) u(y) + z'(t) du(y),  u'(y) = -p(y)
+    #   Y' = dbeta (s(t) - x) + beta (ds(t) - X)
+    # Returns c1, c2, dc1/dtheta, dc2/dtheta, the solution and the sensitivities.
+    t_range = np.linspace(0, T, N + 1)
+    derived_z = z_derivative(z_func, T, N)
+    derived_dz = z_derivative(dz_func, T, N) if dz_func is not None else None
+    du_func = integral.Integral(dp_func) if dp_func is not None else None
+
+    def F(t, u):
+        x, y, X, Y = u
+        dz = derived_z.calculate(t)
+        inside = 0 < y < 1
+        dx = dz * u_func.calculate(y)
+        dy = beta * (s_func.calculate(t) - x)
+        dX = -dz * p_func.calculate(y) * Y if inside else 0.0
+        if derived_dz is not None:
+            dX += derived_dz.calculate(t) * u_func.calculate(y)
+        if du_func is not None and inside:
+            dX += dz * float(du_func.antiderivative(du_func.b) - du_func.antiderivative(y))
+        dY = dbeta * (s_func.calculate(t) - x) - beta * X
+        if ds_func is not None:
+            dY += beta * ds_func.calculate(t)
+        return np.array([dx, dy, dX, dY])
+
+    u = RungeKuttaSystem(F, t_range, np.array([x_0, y_0, 0.0, 0.0]))
+    du = np.array([F(t_range[i], u[i]) for i in range(len(t_range))])
+    solution = Solution(t_range, u[:, 0], u[:, 1], du[:, 0], du[:, 1])
+    sensitivity = Solution(t_range, u[:, 2], u[:, 3], du[:, 2], du[:, 3])
+
+    c1, c2 = criteria(solution, T, p_func, s_func, inner)
+    d_inner = metrics.inner_integral(dp_func) if dp_func is not None else None
+    dc1, dc2 = metrics.criteria_gradient(solution, sensitivity, T, p_func, s_func, inner, d_inner, ds_func)
+    return c1, c2, dc1, dc2, solution, sensitivity
+
+
+def criteria(solution, T, p_func, s_func, inner=None):
+    return metrics.criteria(solution, T, p_func, s_func, inner)
+
+
+def print_solution(x, y, t_range, directory=".", binary=False):
+    if binary:
+        storage.write_table(os.path.join(directory, "x_answer.npy"), t_range, x)
+        storage.write_table(os.path.join(directory, "y_answer.npy"), t_range, y)
+        return
+    with open(os.path.join(directory, "x_answer.txt"), 'w') as output_file:
         for i in range(0, len(t_range)):
             output_file.write("{} {}\n".format(t_range[i], x[i]))
-    with open("y_answer.txt", 'w') as output_file:
+    with open(os.path.join(directory, "y_answer.txt"), 'w') as output_file:
         for i in range(0, len(t_range)):
             output_file.write("{} {}\n".format(t_range[i], y[i]))
\ No newline at end of file
@@ -1,72 +1,77 @@
-import numpy as np
+import copy
 import sys
-from PyQt5.QtWidgets import QApplication as QApp5
-import Solver
-import interface
-from functions import z_function, p_function, s_function, integral, interpolated_function, f_function
+from cache import default_cache
+import optimizer
+import pipeline
 
-def initialize_functions(a, b, c, d):
-    p_func = p_function.PFunction([a, b])
-    z_func = z_function.ZFunction([c])
-    s_func = s_function.SFunction([d])
-
-    return p_func, z_func, s_func
+# PyQt5 and matplotlib (through interface) are imported only when a window
+# or a plot is actually needed, so headless use pays for NumPy alone.
 
 def func_to_min(c):
     return c[0] + 10 * c[1]
 
 def manual_mode(a, b, c, d, x_0, y_0, beta, T, calculating_mod):
-    N = 50
-
-    if calculating_mod == "Ручной" or calculating_mod == "Авто":
-        p_func, z_func, s_func = initialize_functions(a, b, c ,d)
-
-        p_func.tabulate(np.arange(0, T + T/N, T/N), "p_func_tabulated")
-        z_func.tabulate(np.arange(0, T + T/N, T/N), "z_func_tabulated")
-        s_func.tabulate(np.arange(0, T + T/N, T/N), "s_func_tabulated")
-
-    p_interpolated = interpolated_function.InterpolatedFunction("p_func_tabulated")
-    z_interpolated = interpolated_function.InterpolatedFunction("z_func_tabulated")
-    s_interpolated = interpolated_function.InterpolatedFunction("s_func_tabulated")
-
-    p_interpolated.tabulate(np.arange(0, T + T/(N * 100), T/(N * 100)), "p_func_interp_tabulated")
-    z_interpolated.tabulate(np.arange(0, T + T/(N * 100), T/(N * 100)), "z_func_interp_tabulated")
-    s_interpolated.tabulate(np.arange(0, T + T/(N * 100), T/(N * 100)), "s_func_interp_tabulated")
-    
-    integral_p = integral.Integral(p_interpolated)
+    return pipeline.Pipeline(a, b, c, d, T, calculating_mod).solve(x_0, y_0, beta)
 
-    f_func = f_function.FFunction([beta, s_interpolated, z_interpolated, N])
+def scan_mode(a, b, c, d, x_0, y_0, betas, T, calculating_mod):
+    # solves for all the betas at once, returns arrays of c1 and c2
+    return pipeline.Pipeline(a, b, c, d, T, calculating_mod).solve_many(x_0, y_0, betas)
 
-    c1, c2 = Solver.solve(x_0, y_0, beta, T,  N, p_interpolated, z_interpolated, s_interpolated, integral_p, f_func)
+def main(a, b, c, d, x_0, y_0, beta, T, calculating_mod, tolerance=1e-6, method="brent", progress=None, draw=True,
+         exact=False, cache="default", functions=None):
+    # progress(text, fraction, snapshot) is called for every RK chunk and every
+    # optimizer evaluation and may raise Solver.Cancelled; snapshot is a copy
+    # of the pipeline after each solve. Returns the pipeline of the final solve.
+    # exact: solve with p, z, s themselves instead of splines of their tables;
+    # cache: a cache.Cache, None to solve without one, or "default" for the
+    # shared cache.default_cache() that the GUI uses; functions: p, z, s given
+    # instead, e.g. from pipeline.user_functions(), over the exact ones
+    if progress is None:
+        progress = lambda text, fraction=None, snapshot=None: None
+    analytic = calculating_mod == "Ручной" or calculating_mod == "Авто"
+    functions = dict(pipeline.expression_functions(a, b, c, d) if exact and analytic else {}, **(functions or {}))
+    if cache == "default":
+        cache = default_cache()
 
-    return c1, c2
+    def solve(run, beta):
+        rk_progress = lambda fraction: progress("beta = {:.6g}".format(beta), fraction)
+        c = run.solve(x_0, y_0, beta, progress=rk_progress)
+        progress("beta = {:.6g}: c1 = {:.6g}, c2 = {:.6g}".format(beta, c[0], c[1]), 1.0, copy.copy(run))
+        return c
 
-def main(a, b, c, d, x_0, y_0, beta, T, calculating_mod):
     if calculating_mod == "Ручной" or calculating_mod == "Ручной+файл":
-        c1, c2 = manual_mode(a, b, c, d, x_0, y_0, beta, T, calculating_mod)
+        run = pipeline.Pipeline(a, b, c, d, T, calculating_mod, cache=cache,
+                                functions=functions).fit()
+        c1, c2 = solve(run, beta)
         print("c1: {}\n c2: {}".format(c1, c2))
-        interface.draw_graphics(beta, c1, c2)
-        return
-    left, right = beta[0], beta[1]
-    eps = (right - left) / 20
-    delta = (right - left) / 1000
-    while right - left > eps:
-        print("left: {1}, right: {0}".format(right, left))
-        x1 = (right + left - delta) / 2
-        x2 = (right + left + delta) / 2
-        y1 = func_to_min(manual_mode(a, b, c, d, x_0, y_0, x1, T, calculating_mod))
-        y2 = func_to_min(manual_mode(a, b, c, d, x_0, y_0, x2, T, calculating_mod))
-        if y1 >= y2:
-            left = x1
-        else:
-            right = x2
-    c1, c2 = manual_mode(a, b, c, d, x_0, y_0, (left + right) / 2, T, calculating_mod)
-    print("final beta:", (left + right) / 2)
+        if draw:
+            import interface
+            interface.draw_graphics(run)
+        return run
+    # the tables and splines do not depend on beta, so they are built once
+    run = pipeline.Pipeline(a, b, c, d, T, calculating_mod, cache=cache,
+                            functions=functions).fit()
+    if method in optimizer.GRADIENT_METHODS:
+        # func_to_min is linear in (c1, c2), so its derivative is func_to_min of the derivatives
+        def objective(beta):
+            c1, c2, dc1, dc2 = run.gradient(x_0, y_0, beta)
+            progress("beta = {:.6g}: c1 = {:.6g}, c2 = {:.6g}".format(beta, c1, c2), 1.0, copy.copy(run))
+            return func_to_min((c1, c2)), func_to_min((dc1, dc2))
+    else:
+        objective = lambda beta: func_to_min(solve(run, beta))
+    beta, value, evaluations = optimizer.minimize(objective, beta[0], beta[1], tolerance, method)
+    c1, c2 = run.solve(x_0, y_0, beta)
+    print("final beta: {} ({} solves)".format(beta, evaluations))
     print("c1: {}\n c2: {}".format(c1, c2))
-    interface.draw_graphics((left + right) / 2, c1, c2)
+    if draw:
+        import interface
+        interface.draw_graphics(run)
+    return run
 
 
 if __name__ == '__main__':
+    from PyQt5.QtWidgets import QApplication as QApp5
+    import interface
     app = QApp5(sys.argv)
     window = interface.Window(main)
     sys.exit(app.exec_())
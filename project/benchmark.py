@@ -0,0 +1,243 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import Solver
+import app
+import pipeline
+from functions import interpolated_function, integral, f_function
+
+# Headless benchmarks on synthetic p, z, s (the analytic functions with
+# a = 1, b = 2, c = 1, d = 1). Every case is timed `repeat` times and the best
+# wall time per run is kept, together with the evaluation count and the peak memory
+# allocated while the case ran (tracemalloc, measured on a separate run so it
+# does not slow down the timed ones).
+#
+#   python -m benchmark --output bench.json --baseline benchmark_baseline.json
+#   python -m benchmark --save-baseline benchmark_baseline.json
+
+PARAMS = (1, 2, 1, 1)
+T = 1.0
+
+
+class Counted():
+
+    # counts the calls of calculate and calculate_many (every point counts)
+    def __init__(self, func):
+        self.func = func
+        self.evaluations = 0
+
+    def calculate(self, *args):
+        self.evaluations += 1
+        return self.func.calculate(*args)
+
+    def calculate_many(self, x):
+        x = np.asarray(x, dtype=float)
+        self.evaluations += x.size
+        return self.func.calculate_many(x)
+
+
+def table(name, n):
+    grid = np.linspace(0, T, n + 1)
+    func = dict(zip(pipeline.FUNCTION_NAMES, pipeline.initialize_functions(*PARAMS)))[name]
+    return grid, func.calculate_many(grid)
+
+
+def spline_fit(n):
+    x, y = table("z", n)
+    def run():
+        interpolated_function.InterpolatedFunction(None, (x, y))
+        return n
+    return run
+
+
+def spline_scalar(n, points=10000):
+    spline = interpolated_function.InterpolatedFunction(None, table("z", n))
+    ts = np.random.default_rng(0).uniform(0, T, points)
+    def run():
+        for t in ts:
+            spline.calculate(t)
+        return points
+    return run
+
+
+def spline_batch(n, points=10000):
+    spline = interpolated_function.InterpolatedFunction(None, table("z", n))
+    ts = np.random.default_rng(0).uniform(0, T, points)
+    def run():
+        spline.calculate_many(ts)
+        return points
+    return run
+
+
+def integral_calculate(N, points=1000):
+    p = interpolated_function.InterpolatedFunction(None, table("p", 1000))
+    ys = np.random.default_rng(0).uniform(0, 1, points)
+    def run():
+        counted = Counted(p)
+        u = integral.Integral(counted, N=N, method="trapezoid")
+        for y in ys:
+            u.calculate(y)
+        return counted.evaluations
+    return run
+
+
+def runge_kutta(N):
+    fitted = pipeline.Pipeline(*PARAMS, T, "Ручной", N).fit()
+    s, u, derived_z = fitted.splines["s"], fitted.integral_p, fitted.splines["z"].derivative()
+    t = np.linspace(0, T, N + 1)
+    def run():
+        counted = [0]
+        def f(t, x, y):
+            counted[0] += 1
+            return derived_z.calculate(t) * u.calculate(y)
+        def g(t, x, y):
+            counted[0] += 1
+            return 1.3 * (s.calculate(t) - x)
+        Solver.RungeKutta(f, g, t, 0.5, 0.1)
+        return counted[0]
+    return run
+
+
+def full_solve(N, method="rk4"):
+    fitted = pipeline.Pipeline(*PARAMS, T, "Ручной", N).fit()
+    p, z, s = fitted.splines["p"], fitted.splines["z"], fitted.splines["s"]
+    def run():
+        f_func = f_function.FFunction([1.3, s, z, N])
+        solution = Solver.solve(0.5, 0.1, 1.3, T, N, p, z, s, fitted.integral_p, f_func, method=method,
+                                return_solution=True, inner=fitted.inner)[2]
+        return solution.stats["evaluations"]
+    return run
+
+
+def optimization(method="brent"):
+    def run():
+        solves = [0]
+        def progress(text, fraction=None, snapshot=None):
+            if snapshot is not None:
+                solves[0] += 1
+        # without a cache, so that the earlier repetitions cannot answer the solves
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.main(*PARAMS, 0.5, 0.1, (0.1, 3.0), T, "Авто", 1e-6, method, progress, draw=False, cache=None)
+        return solves[0]
+    return run
+
+
+def cases():
+    # name -> zero-argument factory of the timed callable; setup happens in
+    # the factory and is not timed
+    suite = {}
+    for n in (10**3, 10**4, 10**5, 10**6):
+        suite["spline_fit/n={}".format(n)] = lambda n=n: spline_fit(n)
+    for n in (100, 10**4):
+        suite["spline_calculate_scalar/n={}".format(n)] = lambda n=n: spline_scalar(n)
+        suite["spline_calculate_batch/n={}".format(n)] = lambda n=n: spline_batch(n)
+    for N in (100, 1000, 10000):
+        suite["integral_calculate/N={}".format(N)] = lambda N=N: integral_calculate(N)
+    for N in (50, 200, 800):
+        suite["runge_kutta/N={}".format(N)] = lambda N=N: runge_kutta(N)
+    suite["solve/rk4/N=50"] = lambda: full_solve(50)
+    suite["solve/rk45/N=50"] = lambda: full_solve(50, "rk45")
+    suite["optimization/brent"] = lambda: optimization("brent")
+    suite["optimization/secant"] = lambda: optimization("secant")
+    return suite
+
+
+def measure(factory, repeat, min_seconds=0.05):
+    # like timeit: a sample runs the case `number` times, with `number` grown
+    # until a sample takes min_seconds, so short cases are not all noise
+    func = factory()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            evaluations = func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_seconds / elapsed) + 1)
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": min(times), "mean_seconds": sum(times) / len(times), "repeat": repeat,
+            "number": number, "evaluations": evaluations, "peak_bytes": peak}
+
+
+def run_suite(selected=None, repeat=5, log=sys.stderr):
+    results = {}
+    for name, factory in cases().items():
+        if selected and not any(part in name for part in selected):
+            continue
+        results[name] = measure(factory, repeat)
+        print("{:<36} {:>10.4f} s {:>10} evals {:>8.1f} MiB".format(
+            name, results[name]["seconds"], results[name]["evaluations"],
+            results[name]["peak_bytes"] / 2**20), file=log)
+    return {"python": platform.python_version(), "numpy": np.__version__,
+            "machine": platform.machine(), "cases": results}
+
+
+def compare(report, baseline, threshold=1.5):
+    # returns the names of the cases that got slower than threshold times the
+    # baseline, or whose evaluation count changed
+    regressions = []
+    for name, result in report["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        old = baseline["cases"][name]
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] > 0 else float("inf")
+        flags = []
+        if ratio > threshold:
+            flags.append("slower")
+        if result["evaluations"] != old["evaluations"]:
+            flags.append("evaluations {} -> {}".format(old["evaluations"], result["evaluations"]))
+        result["baseline_ratio"] = ratio
+        print("{:<36} x{:<8.2f} {}".format(name, ratio, ", ".join(flags)), file=sys.stderr)
+        if flags:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the spline fit, quadrature, RK solve and optimization")
+    parser.add_argument("cases", nargs="*", help="run only the cases whose names contain one of these")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="JSON file for the results (default: stdout)")
+    parser.add_argument("--baseline", help="JSON file from an earlier run to compare with")
+    parser.add_argument("--save-baseline", help="also write the results here")
+    parser.add_argument("--threshold", type=float, default=1.5, help="allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+    # checked before the suite runs: a mistyped baseline must not pass silently
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error("baseline file not found: {}".format(args.baseline))
+
+    report = run_suite(args.cases, args.repeat)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+    text = json.dumps(report, indent=2)
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, 'w') as f:
+                f.write(text + "\n")
+    if not args.output:
+        print(text)
+    if regressions:
+        sys.exit("regressions: " + ", ".join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import contextlib
+import json
+import sys
+import app
+import cache
+import instrumentation
+import pipeline
+
+# Headless entry point: python -m cli --a 1 --b 2 --c 1 --d 1 --x_0 0.5 --y_0 0.1 --beta 1 --T 1
+# or python -m cli --scenario scenarios.json (a scenario object or a list of them).
+# p, z, s can be given as expressions, see pipeline.user_functions:
+#   python -m cli --z "k * t + cos(t)" --param k=2 --a 1 --b 2 --d 1 ...
+# or in a scenario, {"z": {"expression": "k * t + cos(t)", "params": {"k": 2}}, ...}.
+
+MODES = {("manual", False): "Ручной", ("auto", False): "Авто",
+         ("manual", True): "Ручной+файл", ("auto", True): "Авто+файл"}
+PARAMETERS = ("a", "b", "c", "d", "x_0", "y_0", "beta", "T")
+
+
+def load_scenarios(filename):
+    with open(filename, 'r') as f:
+        if filename.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                sys.exit("PyYAML is needed to read {}".format(filename))
+            scenarios = yaml.safe_load(f)
+        else:
+            scenarios = json.load(f)
+    return scenarios if isinstance(scenarios, list) else [scenarios]
+
+
+def run_scenario(scenario):
+    # beta is a number in manual mode and a [left, right] pair in auto mode
+    mode = scenario.get("mode", "auto" if isinstance(scenario["beta"], list) else "manual")
+    calculating_mod = MODES[(mode, bool(scenario.get("files", False)))]
+    params = [scenario.get(name) for name in PARAMETERS]
+    functions = pipeline.user_functions({name: scenario[name] for name in pipeline.FUNCTION_NAMES if name in scenario},
+                                        *params[:4])
+    # app.main reports to stdout, which is reserved for the results here
+    with contextlib.redirect_stdout(sys.stderr):
+        run = app.main(*params, calculating_mod, tolerance=scenario.get("tolerance", 1e-6),
+                       method=scenario.get("optimizer", "brent"), draw=False, exact=scenario.get("exact", False),
+                       cache=cache.default_cache() if scenario.get("cache", False) else None, functions=functions)
+    if scenario.get("export"):
+        run.export(scenario["export"], scenario["export"], scenario.get("binary", False))
+    if scenario.get("plot"):
+        import interface
+        interface.draw_graphics(run)
+    return {"scenario": scenario, "beta": float(run.beta), "c1": float(run.c1), "c2": float(run.c2),
+            "x_T": float(run.solution.x[-1]), "y_T": float(run.solution.y[-1])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve without the GUI")
+    parser.add_argument("--scenario", help="JSON or YAML file with one scenario or a list of them")
+    for name in PARAMETERS:
+        parser.add_argument("--" + name, type=float, nargs='+' if name == "beta" else None,
+                            help="beta: one value, or left and right ends for the auto mode" if name == "beta" else None)
+    for name in pipeline.FUNCTION_NAMES:
+        parser.add_argument("--" + name, help="{} as an expression in {}".format(name, pipeline.FUNCTION_VARIABLES[name]))
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="a parameter of the --p, --z, --s expressions (repeatable)")
+    parser.add_argument("--files", action="store_true", help="read p, z, s from tabulated_functions/")
+    parser.add_argument("--cache", action="store_true", help="reuse and store results in the on-disk cache")
+    parser.add_argument("--exact", action="store_true", help="solve with p, z, s themselves, not their splines")
+    parser.add_argument("--tolerance", type=float, default=1e-6)
+    parser.add_argument("--optimizer", choices=["brent", "golden", "secant"], default="brent")
+    parser.add_argument("--export", help="directory for the tables and the trajectory")
+    parser.add_argument("--binary", action="store_true", help="export .npy instead of text")
+    parser.add_argument("--plot", action="store_true")
+    parser.add_argument("--output", help="JSON file for the results (default: stdout)")
+    parser.add_argument("--trace", help="count evaluations and time the stages; writes a Chrome trace here "
+                                        "and a summary to stderr")
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        scenarios = load_scenarios(args.scenario)
+    else:
+        scenario = {name: getattr(args, name) for name in PARAMETERS}
+        if scenario["beta"] is None or scenario["x_0"] is None or scenario["y_0"] is None or scenario["T"] is None:
+            parser.error("--beta, --x_0, --y_0 and --T are required without --scenario")
+        scenario["beta"] = scenario["beta"][0] if len(scenario["beta"]) == 1 else scenario["beta"][:2]
+        try:
+            params = {name: float(value) for name, value in (param.split("=", 1) for param in args.param)}
+        except ValueError:
+            parser.error("--param takes NAME=VALUE")
+        for name in pipeline.FUNCTION_NAMES:
+            if getattr(args, name) is not None:
+                scenario[name] = {"expression": getattr(args, name), "params": params}
+        scenario.update(files=args.files, exact=args.exact, cache=args.cache, tolerance=args.tolerance,
+                        optimizer=args.optimizer, export=args.export, binary=args.binary, plot=args.plot)
+        scenarios = [scenario]
+
+    if args.trace:
+        instrumentation.enable()
+    results = [run_scenario(scenario) for scenario in scenarios]
+    if args.trace:
+        instrumentation.chrome_trace(args.trace)
+        print(instrumentation.summary(), file=sys.stderr)
+        instrumentation.disable()
+    text = json.dumps(results if args.scenario else results[0], indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
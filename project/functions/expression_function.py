@@ -0,0 +1,211 @@
+import ast
+import numpy as np
+from functions import storage
+
+# A function of one variable given as an expression string, e.g.
+#   ExpressionFunction("a * w * (b - w)", "w", {"a": 1, "b": 2})
+# or as a NumPy callable f(t, **params). Expressions are parsed once, checked
+# against a whitelist (numbers, the variable, the parameters, pi, e, + - * / **
+# and the functions in FUNCTIONS) and compiled to a single vectorized
+# evaluation. derivative() is symbolic for expressions and uses the complex
+# step for callables, falling back to a central difference for callables that
+# do not accept complex input.
+
+FUNCTIONS = {name: getattr(np, name) for name in
+             ("sin", "cos", "tan", "arcsin", "arccos", "arctan", "sinh", "cosh", "tanh",
+              "exp", "log", "log10", "sqrt", "abs", "sign")}
+CONSTANTS = {"pi": np.pi, "e": np.e}
+OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+COMPLEX_STEP = 1e-20
+
+
+def number(value):
+    return ast.Constant(value=float(value))
+
+
+def is_number(node, value=None):
+    return isinstance(node, ast.Constant) and (value is None or node.value == value)
+
+
+def add(left, right):
+    if is_number(left, 0):
+        return right
+    if is_number(right, 0):
+        return left
+    return ast.BinOp(left=left, op=ast.Add(), right=right)
+
+
+def subtract(left, right):
+    if is_number(right, 0):
+        return left
+    if is_number(left, 0):
+        return negate(right)
+    return ast.BinOp(left=left, op=ast.Sub(), right=right)
+
+
+def multiply(left, right):
+    if is_number(left, 0) or is_number(right, 0):
+        return number(0)
+    if is_number(left, 1):
+        return right
+    if is_number(right, 1):
+        return left
+    return ast.BinOp(left=left, op=ast.Mult(), right=right)
+
+
+def divide(left, right):
+    if is_number(left, 0):
+        return number(0)
+    if is_number(right, 1):
+        return left
+    return ast.BinOp(left=left, op=ast.Div(), right=right)
+
+
+def power(left, right):
+    return ast.BinOp(left=left, op=ast.Pow(), right=right)
+
+
+def negate(node):
+    if is_number(node):
+        return number(-node.value)
+    return ast.UnaryOp(op=ast.USub(), operand=node)
+
+
+def call(name, argument):
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[argument], keywords=[])
+
+
+def outer_derivative(name, u):
+    # d/du of FUNCTIONS[name](u)
+    rules = {
+        "sin": lambda: call("cos", u),
+        "cos": lambda: negate(call("sin", u)),
+        "tan": lambda: divide(number(1), power(call("cos", u), number(2))),
+        "arcsin": lambda: divide(number(1), call("sqrt", subtract(number(1), power(u, number(2))))),
+        "arccos": lambda: negate(divide(number(1), call("sqrt", subtract(number(1), power(u, number(2)))))),
+        "arctan": lambda: divide(number(1), add(number(1), power(u, number(2)))),
+        "sinh": lambda: call("cosh", u),
+        "cosh": lambda: call("sinh", u),
+        "tanh": lambda: divide(number(1), power(call("cosh", u), number(2))),
+        "exp": lambda: call("exp", u),
+        "log": lambda: divide(number(1), u),
+        "log10": lambda: divide(number(1), multiply(u, number(np.log(10)))),
+        "sqrt": lambda: divide(number(0.5), call("sqrt", u)),
+        "abs": lambda: call("sign", u),
+        "sign": lambda: number(0),
+    }
+    if name not in rules:
+        raise ValueError("No symbolic derivative for {}()".format(name))
+    return rules[name]()
+
+
+def differentiate(node, variable):
+    # symbolic d/d(variable) of a checked expression tree
+    if isinstance(node, ast.Constant):
+        return number(0)
+    if isinstance(node, ast.Name):
+        return number(1 if node.id == variable else 0)
+    if isinstance(node, ast.UnaryOp):
+        inner = differentiate(node.operand, variable)
+        return negate(inner) if isinstance(node.op, ast.USub) else inner
+    if isinstance(node, ast.Call):
+        return multiply(outer_derivative(node.func.id, node.args[0]), differentiate(node.args[0], variable))
+    left, right = node.left, node.right
+    d_left, d_right = differentiate(left, variable), differentiate(right, variable)
+    if isinstance(node.op, ast.Add):
+        return add(d_left, d_right)
+    if isinstance(node.op, ast.Sub):
+        return subtract(d_left, d_right)
+    if isinstance(node.op, ast.Mult):
+        return add(multiply(d_left, right), multiply(left, d_right))
+    if isinstance(node.op, ast.Div):
+        return divide(subtract(multiply(d_left, right), multiply(left, d_right)), power(right, number(2)))
+    # u ** v
+    if is_number(d_right, 0):
+        return multiply(multiply(right, power(left, subtract(right, number(1)))), d_left)
+    return multiply(node, add(multiply(d_right, call("log", left)), divide(multiply(right, d_left), left)))
+
+
+class ExpressionFunction():
+
+    def __init__(self, expression, variable="t", params=None, derivative=None):
+        # expression: a string or a callable f(variable, **params);
+        # derivative: optionally the derivative of a callable, same signature
+        self.variable = variable
+        self.params = dict(params or {})
+        if callable(expression):
+            self.tree = None
+            self.function = expression
+            self.derivative_function = derivative
+            self.expression = getattr(expression, "__qualname__", repr(expression))
+        else:
+            self.tree = self.check(ast.parse(expression.strip(), mode="eval").body)
+            self.expression = ast.unparse(self.tree)
+            self.code = compile(ast.Expression(body=self.tree), "<expression>", "eval")
+            self.function = None
+
+    def check(self, tree):
+        names = set(self.params) | set(CONSTANTS) | {self.variable}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                if (not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS
+                        or len(node.args) != 1 or node.keywords):
+                    raise ValueError("Only {} of one argument are allowed".format(", ".join(FUNCTIONS)))
+            elif isinstance(node, ast.Name):
+                if node.id not in names and node.id not in FUNCTIONS:
+                    raise ValueError("Unknown name in expression: {}".format(node.id))
+            elif isinstance(node, ast.Constant):
+                if not isinstance(node.value, (int, float)) or isinstance(node.value, bool):
+                    raise ValueError("Only numbers are allowed as constants")
+                # as floats, 9**9**9 overflows at once instead of growing a
+                # huge Python integer
+                try:
+                    node.value = float(node.value)
+                except OverflowError:
+                    raise ValueError("Constant out of the float range") from None
+            elif not isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Load) + OPERATORS):
+                raise ValueError("Not allowed in expression: {}".format(type(node).__name__))
+        return tree
+
+    def __repr__(self):
+        return "ExpressionFunction({!r}, {!r}, {!r})".format(self.expression, self.variable, self.params)
+
+    def evaluate(self, values):
+        if self.function is not None:
+            return self.function(values, **self.params)
+        namespace = dict(CONSTANTS, **self.params)
+        namespace[self.variable] = values
+        return eval(self.code, {"__builtins__": {}, **FUNCTIONS}, namespace)
+
+    def calculate_many(self, t):
+        t = np.asarray(t, dtype=float)
+        # constant expressions still come back in the shape of t
+        return np.asarray(self.evaluate(t), dtype=float) + np.zeros(t.shape)
+
+    def calculate(self, t):
+        return float(self.calculate_many(t))
+
+    def derivative(self):
+        if self.tree is not None:
+            tree = ast.fix_missing_locations(differentiate(self.tree, self.variable))
+            return ExpressionFunction(ast.unparse(tree), self.variable, self.params)
+        if self.derivative_function is not None:
+            return ExpressionFunction(self.derivative_function, self.variable, self.params)
+        function, params = self.function, self.params
+        try:
+            probe = function(np.array([0.5 + 1j * COMPLEX_STEP]), **params)
+            complex_step = np.iscomplexobj(probe) and np.all(np.imag(probe) != 0)
+        except (TypeError, ValueError):
+            complex_step = False
+        if complex_step:
+            def derived(t, **params):
+                return np.imag(function(np.asarray(t) + 1j * COMPLEX_STEP, **params)) / COMPLEX_STEP
+        else:
+            def derived(t, **params):
+                h = np.cbrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(t))
+                return (function(t + h, **params) - function(t - h, **params)) / (2 * h)
+        return ExpressionFunction(derived, self.variable, self.params)
+
+    def tabulate(self, points, filename):
+        points = np.asarray(points, dtype=float)
+        storage.write_table("tabulated_functions/" + filename, points, self.calculate_many(points))
@@ -1,31 +1,214 @@
-import numpy
-import pandas as pd
+import numpy as np
+from functions import interpolated_function, storage
+
+# 15-point Kronrod rule and the embedded 7-point Gauss rule on [-1, 1]
+KRONROD_NODES = np.array([
+    -0.991455371120812639206854697526329, -0.949107912342758524526189684047851,
+    -0.864864423359769072789712788640926, -0.741531185599394439863864773280788,
+    -0.586087235467691130294144845693013, -0.405845151377397166906606412076961,
+    -0.207784955007898467600689403773245, 0.0,
+    0.207784955007898467600689403773245, 0.405845151377397166906606412076961,
+    0.586087235467691130294144845693013, 0.741531185599394439863864773280788,
+    0.864864423359769072789712788640926, 0.949107912342758524526189684047851,
+    0.991455371120812639206854697526329])
+KRONROD_WEIGHTS = np.array([
+    0.022935322010529224963732008058970, 0.063092092629978553290700663189204,
+    0.104790010322250183839876322541518, 0.140653259715525918745189590510238,
+    0.169004726639267902826583426598550, 0.190350578064785409913256402421014,
+    0.204432940075298892414161999234649, 0.209482141084727828012999174891714,
+    0.204432940075298892414161999234649, 0.190350578064785409913256402421014,
+    0.169004726639267902826583426598550, 0.140653259715525918745189590510238,
+    0.104790010322250183839876322541518, 0.063092092629978553290700663189204,
+    0.022935322010529224963732008058970])
+GAUSS_7_WEIGHTS = np.array([
+    0.0, 0.129484966168869693270611432679082, 0.0, 0.279705391489276667901467771423780,
+    0.0, 0.381830050505118944950369775488975, 0.0, 0.417959183673469387755102040816327,
+    0.0, 0.381830050505118944950369775488975, 0.0, 0.279705391489276667901467771423780,
+    0.0, 0.129484966168869693270611432679082, 0.0])
+
+legendre_cache = {}
+
+
+def legendre_rule(n):
+    if n not in legendre_cache:
+        legendre_cache[n] = np.polynomial.legendre.leggauss(n)
+    return legendre_cache[n]
+
 
 class Integral():
 
-    a = b = -1
+    a = 0
+    b = 1
+    methods = ("table", "trapezoid", "simpson", "gauss-legendre", "gauss-kronrod")
 
-    def __init__(self, params):
+    def __init__(self, params, N=10000, method="table", atol=1e-10, rtol=1e-10, max_evaluations=100000):
+        # method "table" answers calculate() from the cumulative antiderivative,
+        # the others run the corresponding quadrature engine on every call
+        if method not in self.methods:
+            raise ValueError("Unknown quadrature method: {}".format(method))
         self.params = params
+        self.N = N
+        self.method = method
+        self.atol = atol
+        self.rtol = rtol
+        self.max_evaluations = max_evaluations
+        self.table = None
+
+    def invalidate(self):
+        # must be called when the integrand changes
+        self.table = None
+
+    def evaluate(self, points):
+        if hasattr(self.params, "calculate_many"):
+            return self.params.calculate_many(points)
+        return np.array([self.params.calculate(x) for x in points], dtype=float)
+
+    def build_table(self):
+        if isinstance(self.params, interpolated_function.InterpolatedFunction):
+            # exact integral of the cubic pieces
+            self.table = ("spline", self.params.antiderivative())
+        else:
+            # cumulative trapezoid on a uniform grid over [a, b]; N is even, so
+            # every other node gives the table with step 2h for error estimates
+            N = self.N + self.N % 2
+            grid = np.linspace(self.a, self.b, N + 1)
+            values = self.evaluate(grid)
+            self.table = ("trapezoid", self.cumulative(grid, values), self.cumulative(grid[::2], values[::2]))
+
+    @staticmethod
+    def cumulative(grid, values):
+        h = grid[1] - grid[0]
+        return grid, values, np.concatenate([[0.0], np.cumsum((values[1:] + values[:-1]) / 2 * h)])
+
+    @staticmethod
+    def linear_antiderivative(points, grid, values, cumulative):
+        # exact antiderivative of the piecewise linear interpolant
+        h = grid[1] - grid[0]
+        indx = np.clip(((points - grid[0]) // h).astype(int), 0, len(grid) - 2)
+        dx = points - grid[indx]
+        slope = (values[indx + 1] - values[indx]) / h
+        return cumulative[indx] + dx * (values[indx] + slope * dx / 2)
+
+    def antiderivative(self, points, coarse=False):
+        # coarse=True answers from the table with twice the step (trapezoid only)
+        if self.table is None:
+            self.build_table()
+        points = np.asarray(points, dtype=float)
+        if self.table[0] == "spline":
+            return self.table[1].calculate_many(points)
+        return self.linear_antiderivative(points, *self.table[2 if coarse else 1])
+
+    def table_integral(self, a, b):
+        # the table covers [self.a, self.b] only; its error is estimated
+        # against the table with twice the step, like the trapezoid engine
+        if not (self.a <= min(a, b) and max(a, b) <= self.b):
+            raise ValueError("The table covers [{}, {}]; integrate over [{}, {}] with another method"
+                             .format(self.a, self.b, a, b))
+        evaluations = 0
+        if self.table is None:
+            self.build_table()
+            evaluations = 0 if self.table[0] == "spline" else len(self.table[1][0])
+        value = float(self.antiderivative(b) - self.antiderivative(a))
+        if self.table[0] == "spline":
+            return value, 0.0, evaluations
+        coarse = float(self.antiderivative(b, True) - self.antiderivative(a, True))
+        return value, abs(value - coarse) / 3, evaluations
+
+    def trapezoid(self, a, b, N):
+        N += N % 2
+        values = self.evaluate(np.linspace(a, b, N + 1))
+        h = (b - a) / N
+        fine = h * (values.sum() - (values[0] + values[-1]) / 2)
+        coarse = 2 * h * (values[::2].sum() - (values[0] + values[-1]) / 2)
+        return fine, abs(fine - coarse) / 3, N + 1
+
+    def simpson(self, a, b, N):
+        N += -N % 4
+        values = self.evaluate(np.linspace(a, b, N + 1))
+        h = (b - a) / N
+        fine = h / 3 * (values[0] + 4 * values[1:-1:2].sum() + 2 * values[2:-1:2].sum() + values[-1])
+        half = values[::2]
+        coarse = 2 * h / 3 * (half[0] + 4 * half[1:-1:2].sum() + 2 * half[2:-1:2].sum() + half[-1])
+        return fine, abs(fine - coarse) / 15, N + 1
+
+    def gauss_legendre(self, a, b, N):
+        # the error is estimated against the rule with half as many nodes
+        center, radius = (a + b) / 2, (b - a) / 2
+        nodes, weights = legendre_rule(N)
+        value = radius * np.dot(weights, self.evaluate(center + radius * nodes))
+        nodes, weights = legendre_rule(max(N // 2, 1))
+        coarse = radius * np.dot(weights, self.evaluate(center + radius * nodes))
+        return value, abs(value - coarse), N + max(N // 2, 1)
+
+    def gauss_kronrod(self, a, b, atol, rtol, max_evaluations):
+        # Globally adaptive G7-K15: every round bisects all the intervals whose
+        # error is above their share of the tolerance and evaluates the new
+        # intervals in a single vectorized call.
+        def rule(lefts, rights):
+            centers, radii = (lefts + rights) / 2, (rights - lefts) / 2
+            points = centers[:, None] + radii[:, None] * KRONROD_NODES
+            values = self.evaluate(points.ravel()).reshape(points.shape)
+            kronrod = radii * values.dot(KRONROD_WEIGHTS)
+            gauss = radii * values.dot(GAUSS_7_WEIGHTS)
+            return kronrod, np.abs(kronrod - gauss)
+
+        lefts, rights = np.array([a], dtype=float), np.array([b], dtype=float)
+        values, errors = rule(lefts, rights)
+        evaluations = len(KRONROD_NODES)
+        while True:
+            value, error = values.sum(), errors.sum()
+            tolerance = max(atol, rtol * abs(value))
+            if error <= tolerance:
+                break
+            split = errors > tolerance * (rights - lefts) / (b - a)
+            if not split.any():
+                split = errors == errors.max()
+            if evaluations + 2 * len(KRONROD_NODES) * split.sum() > max_evaluations:
+                break
+            middles = (lefts[split] + rights[split]) / 2
+            new_lefts = np.concatenate([lefts[split], middles])
+            new_rights = np.concatenate([middles, rights[split]])
+            new_values, new_errors = rule(new_lefts, new_rights)
+            evaluations += len(KRONROD_NODES) * len(new_lefts)
+            lefts = np.concatenate([lefts[~split], new_lefts])
+            rights = np.concatenate([rights[~split], new_rights])
+            values = np.concatenate([values[~split], new_values])
+            errors = np.concatenate([errors[~split], new_errors])
+        return value, error, evaluations
+
+    def integrate(self, a, b=None, method=None, N=None):
+        # returns (value, error estimate, number of integrand evaluations);
+        # "table" counts the evaluations of the table when this call builds it
+        b = self.b if b is None else b
+        method = self.method if method is None else method
+        if method == "table":
+            return self.table_integral(a, b)
+        if method == "trapezoid":
+            return self.trapezoid(a, b, self.N if N is None else N)
+        if method == "simpson":
+            return self.simpson(a, b, self.N if N is None else N)
+        if method == "gauss-legendre":
+            return self.gauss_legendre(a, b, 20 if N is None else N)
+        if method == "gauss-kronrod":
+            return self.gauss_kronrod(a, b, self.atol, self.rtol, self.max_evaluations)
+        raise ValueError("Unknown quadrature method: {}".format(method))
+
+    def calculate_many(self, a):
+        a = np.asarray(a, dtype=float)
+        if self.method == "table":
+            result = self.antiderivative(self.b) - self.antiderivative(np.clip(a, self.a, self.b))
+        else:
+            limits = np.clip(a, self.a, self.b)
+            result = np.array([self.integrate(x)[0] for x in limits.ravel()]).reshape(a.shape)
+        return np.where(a <= self.a, 1.0, np.where(a >= self.b, 0.0, result))
 
-    def calculate(self, a, N=10000):
-        b = 1
-        if a <= 0:
+    def calculate(self, a):
+        if a <= self.a:
             return 1
-        if a >= 1:
+        if a >= self.b:
             return 0
-        h = float(b - a) / N*2
-        s = 0.0
-        x = a
-        s += self.params.calculate(x)/2.0
-        for i in range(1, N):
-            x = a + i * h
-            s += self.params.calculate(x)
-        x = b
-        s += self.params.calculate(x)/2.0
-        return s * h
+        return float(self.calculate_many(a))
 
     def tabulate(self, points, filename):
-        with open("tabulated_functions/" + filename, 'w') as f:
-            for x in points:
-                f.write("{} {}\n".format(x, self.calculate(x, (points[1] - points[0]) / 1)))
+        points = np.asarray(points, dtype=float)
+        storage.write_table("tabulated_functions/" + filename, points, self.calculate_many(points))
@@ -1,89 +1,318 @@
 import numpy as np
 import bisect
+from functions import storage
+
+
+def thomas(lower, diag, upper, rhs):
+    # Solves a tridiagonal system stored as three diagonals:
+    # lower[i] * u[i-1] + diag[i] * u[i] + upper[i] * u[i+1] = rhs[i]
+    # (lower[0] and upper[-1] are ignored). rhs may be (n,) or (n, K).
+    n = len(diag)
+    rhs = np.array(rhs, dtype=float)
+    cp = np.zeros(n)
+    for i in range(n):
+        m = diag[i] - (lower[i] * cp[i - 1] if i > 0 else 0)
+        if m == 0:
+            raise ValueError("Tridiagonal system is singular")
+        cp[i] = upper[i] / m if i < n - 1 else 0
+        rhs[i] = (rhs[i] - (lower[i] * rhs[i - 1] if i > 0 else 0)) / m
+    for i in range(n - 2, -1, -1):
+        rhs[i] = rhs[i] - cp[i] * rhs[i + 1]
+    return rhs
+
+
+def solve_tridiagonal(lower, diag, upper, rhs):
+    # Odd-even cyclic reduction: every level eliminates the odd unknowns with
+    # whole-array operations and halves the system, so the total work stays
+    # O(n) without a Python loop over the rows. Small systems go to thomas.
+    lower = np.asarray(lower, dtype=float)
+    diag = np.asarray(diag, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    rhs = np.asarray(rhs, dtype=float)
+    n = len(diag)
+    if n <= 16:
+        return thomas(lower, diag, upper, rhs)
+
+    col = (slice(None),) + (None,) * (rhs.ndim - 1)
+    zero = np.zeros((1,) + rhs.shape[1:])
+    # index n points at a padding row that makes the edge rows uniform
+    lower_p = np.append(lower, 0.0)
+    diag_p = np.append(diag, 1.0)
+    upper_p = np.append(upper, 0.0)
+    rhs_p = np.concatenate([rhs, zero])
+
+    even = np.arange(0, n, 2)
+    prev = even - 1
+    prev[0] = n
+    succ = even + 1
+    succ[succ >= n] = n
+    alpha = -lower_p[even] / diag_p[prev]
+    gamma = -upper_p[even] / diag_p[succ]
+
+    x_even = solve_tridiagonal(alpha * lower_p[prev],
+                               diag_p[even] + alpha * upper_p[prev] + gamma * lower_p[succ],
+                               gamma * upper_p[succ],
+                               rhs_p[even] + alpha[col] * rhs_p[prev] + gamma[col] * rhs_p[succ])
+
+    odd = np.arange(1, n, 2)
+    x_even_p = np.concatenate([x_even, zero])
+    x = np.empty(rhs.shape)
+    x[0::2] = x_even
+    x[1::2] = (rhs[odd] - lower[odd][col] * x_even[(odd - 1) // 2]
+               - upper[odd][col] * x_even_p[(odd + 1) // 2]) / diag[odd][col]
+    return x
+
 
 class InterpolatedFunction():
 
-    def __init__(self, tabulated_func_filename, points=None):
+    def __init__(self, tabulated_func_filename, points=None, bc_type="natural", bc_values=(0.0, 0.0), cache=None):
+        # bc_type: "natural", "clamped" (bc_values are s'(x_0), s'(x_n)) or "not-a-knot";
+        # cache: a cache.Cache to reuse the solution of the spline system
+        self.bc_type = bc_type
+        self.bc_values = bc_values
+        self.cache = cache
         self.params = self.calculate_interpolation_coeffs(tabulated_func_filename, points)
 
+    def fill_in_matrix(self, n, h, y, first=True, last=True):
+        # Equations for c_1 .. c_{n-1}; the end conditions are folded into the
+        # first and the last rows, so only the three diagonals are stored.
+        # first/last=False leave out the condition at that end, for a block
+        # of rows taken from the middle of a longer table. y may also be
+        # (n + 1, K), K tables on the same knots, which gives K rhs columns.
+        slope = np.diff(y, axis=0) / (h if y.ndim == 1 else h[:, None])
+        lower = np.zeros(n - 1)
+        diag = 2 * (h[:-1] + h[1:])
+        upper = np.zeros(n - 1)
+        lower[1:] = h[1:-1]
+        upper[:-1] = h[1:-1]
+        rhs = 3 * (slope[1:] - slope[:-1])
+
+        if self.bc_type == "clamped":
+            if first:
+                diag[0] -= h[0] / 2
+                rhs[0] -= 1.5 * (slope[0] - self.bc_values[0])
+            if last:
+                diag[-1] -= h[-1] / 2
+                rhs[-1] -= 1.5 * (self.bc_values[1] - slope[-1])
+        elif self.bc_type == "not-a-knot":
+            if first:
+                diag[0] = (h[0] + h[1]) * (h[0] + 2 * h[1]) / h[1]
+                upper[0] = (h[1] - h[0]) * (h[1] + h[0]) / h[1]
+            if last:
+                diag[-1] = (h[-1] + h[-2]) * (h[-1] + 2 * h[-2]) / h[-2]
+                lower[-1] = (h[-2] - h[-1]) * (h[-2] + h[-1]) / h[-2]
+        elif self.bc_type != "natural":
+            raise ValueError("Unknown boundary condition: {}".format(self.bc_type))
+
+        return lower, diag, upper, rhs
+
+    def end_values(self, c, h, y):
+        slope_0 = (y[1] - y[0]) / h[0]
+        slope_n = (y[-1] - y[-2]) / h[-1]
+        if self.bc_type == "clamped":
+            c[0] = (3 * (slope_0 - self.bc_values[0]) - h[0] * c[1]) / (2 * h[0])
+            c[-1] = (3 * (self.bc_values[1] - slope_n) - h[-1] * c[-2]) / (2 * h[-1])
+        elif self.bc_type == "not-a-knot":
+            c[0] = ((h[0] + h[1]) * c[1] - h[0] * c[2]) / h[1]
+            c[-1] = ((h[-1] + h[-2]) * c[-2] - h[-1] * c[-3]) / h[-2]
 
-    def fill_in_matrix(self, A, b, n, h, y):
-        for i in range(1, n-2):
-            A[i][i-1] = h[i]
-            
-            A[i][i  ] = 2*(h[i]+h[i+1])
-            
-            A[i][i+1] = h[i+1]
-        
-            b[i] = 3 * ((y[i+2] - y[i+1]) / h[i+1] - (y[i+1] - y[i]) / h[i])
-        
-        A[0][0  ] = 2*(h[0] + h[1])
-        A[0][1  ] = h[1]
-        b[0] = 3 * ((y[2] - y[1]) / h[1] - (y[1] - y[0]) / h[0])
-        
-        A[n-2][n-3] = h[n-2]
-        A[n-2][n-2] = 2*(h[n-2] + h[n-1])
-        b[n-2] = 3 * ((y[n] - y[n-1]) / h[n-1] - (y[n-1] - y[n-2]) / h[n-2])
-
-        return(A, b)
-
-    def kramer(self, m, b):
-        tmp = list(zip(*m))
-        delta = np.linalg.det(tmp)
-        if delta == 0:
-            return "Решений нет"
-        result = []
-        for i in range(len(m)):
-            A = tmp[:]
-            A[i] = b
-            result.append((np.linalg.det(A) / delta))
-        return np.array(result)
-
-    def getSpline(self, x, y): 
+    def short_table(self, n, h, y):
+        # Fewer than four knots: the interior system degenerates.
+        c = np.zeros(n + 1)
+        if n == 1:
+            if self.bc_type == "clamped":
+                slope = (y[1] - y[0]) / h[0]
+                c[:] = thomas([0, h[0]], [2 * h[0], 2 * h[0]], [h[0], 0],
+                              [3 * (slope - self.bc_values[0]), 3 * (self.bc_values[1] - slope)])
+        elif self.bc_type == "not-a-knot":
+            # a single parabola through three points
+            c[:] = 3 * ((y[2] - y[1]) / h[1] - (y[1] - y[0]) / h[0]) / (3 * (h[0] + h[1]))
+        else:
+            lower, diag, upper, rhs = self.fill_in_matrix(n, h, y)
+            c[1] = rhs[0] / diag[0]
+            self.end_values(c, h, y)
+        return c
 
+    def getSpline(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
         n = len(x) - 1
-        
-        h = [float(x[i] - x[i - 1]) for i in range(1, n + 1)]
-        
-
-        self.x, self.a = x, y
-
-        self.b = [0] * (n + 1)
-        self.c = [0] * (n + 1)
-        self.d = [0] * (n + 1)
-        
-        
-        A = np.zeros((n-1, n-1))
-        b = np.zeros((n-1))
-
-        
-        A, b = self.fill_in_matrix(A, b, n, h, y)
-
-        ans = self.kramer(A, b)
-
-        for i in reversed(range(1, n)): self.c[i] = ans[i-1]
-        self.c[0], self.c[n] = 0, 0
-        
-        for i in reversed(range(1,n+1)):
-            self.d[i] = (self.c[i] - self.c[i-1]) / (3*h[i - 1])
-            self.b[i] = ((y[i] - y[i-1]) / h[i-1]) + h[i-1]*(2*self.c[i] + (self.c[i-1]))/3
+        if n < 1:
+            raise ValueError("At least two knots are needed")
+
+        h = np.diff(x)
+
+        name = entry = None
+        if self.cache is not None:
+            name = self.cache.key("spline", x, y, self.bc_type, tuple(self.bc_values))
+            entry = self.cache.get(name)
+
+        if entry is not None:
+            c = entry["c"]
+        elif n < 3:
+            c = self.short_table(n, h, y)
+        else:
+            c = np.zeros(n + 1)
+            lower, diag, upper, rhs = self.fill_in_matrix(n, h, y)
+            c[1:n] = solve_tridiagonal(lower, diag, upper, rhs)
+            self.end_values(c, h, y)
+        if name is not None and entry is None:
+            self.cache.put(name, {"c": c})
+
+        # Segment i covers [x_{i-1}, x_i] and is expanded around its right end x_i.
+        # Segment 0, left of x_0, is the constant y_0 for every end condition:
+        # c_0 only enters segment 1 and is left out of it.
+        self.a = y
+        self.b = np.zeros(n + 1)
+        self.c = c.copy()
+        self.c[0] = 0.0
+        self.d = np.zeros(n + 1)
+        self.d[1:] = (c[1:] - c[:-1]) / (3 * h)
+        self.b[1:] = (y[1:] - y[:-1]) / h + h * (2 * c[1:] + c[:-1]) / 3
         self.x = x
         self.f = y
+        self.coeffs = [self.a, self.b, self.c, self.d]
+        self.outside = 0.0
         return None
 
+    @classmethod
+    def from_coefficients(cls, x, coeffs, outside=0.0):
+        # coeffs[k][i] multiplies (t - x_i)^k on segment i
+        spline = cls.__new__(cls)
+        spline.bc_type = spline.bc_values = spline.params = None
+        coeffs = list(coeffs) + [np.zeros(len(x))] * (4 - len(coeffs))
+        spline.x = x
+        spline.coeffs = coeffs
+        spline.a, spline.b, spline.c, spline.d = coeffs[:4]
+        spline.f = spline.a
+        spline.outside = outside
+        return spline
+
+    @classmethod
+    def load(cls, store, mmap=True):
+        # a spline saved as rows x, a, b, c, d (see stream); memory-mapped, so
+        # evaluation only pages in the segments it touches
+        x, *coeffs = storage.read_table(store, mmap)
+        return cls.from_coefficients(x, coeffs)
+
+    @classmethod
+    def stream(cls, table, store, chunk=2**17, bc_type="natural", bc_values=(0.0, 0.0)):
+        # Fits a table too large for memory. The rows of the spline system are
+        # split into blocks of `chunk`; every block is solved for its right-hand
+        # side and for unit couplings to its two neighbours, the 2 unknowns per
+        # block at the block ends are found from a small dense system, and a
+        # second pass recovers the rest. Only one block is in memory at a time;
+        # the table is read through a memory map (text tables through the
+        # conversion storage.mapped keeps up to date) and the coefficients go
+        # to store as rows x, a, b, c, d.
+        X, Y = storage.read_table(storage.mapped(table))[:2]
+        n = len(X) - 1
+        spline = cls.__new__(cls)
+        spline.bc_type, spline.bc_values, spline.cache = bc_type, bc_values, None
+
+        # written under a unique name and moved to store when complete, so
+        # concurrent fits of the same table do not truncate each other's file
+        with storage.replacing(store) as temporary:
+            out = np.lib.format.open_memmap(temporary, mode="w+", dtype=np.float64, shape=(5, n + 1))
+            if n - 1 <= 2 * chunk:
+                spline.getSpline(np.array(X), np.array(Y))
+                for row, values in enumerate([spline.x] + spline.coeffs):
+                    out[row] = values
+            else:
+                spline.stream_coefficients(X, Y, out, chunk)
+            out.flush()
+            del out
+        return cls.load(store)
+
+    def block_solutions(self, X, Y, n, start, end):
+        # rows start .. end-1 (unknowns c_start .. c_{end-1}): the solutions
+        # for the right-hand side and for unit couplings to c_{start-1}, c_end
+        x = np.array(X[start - 1:end + 1])
+        y = np.array(Y[start - 1:end + 1])
+        h = np.diff(x)
+        lower, diag, upper, rhs = self.fill_in_matrix(end - start + 1, h, y, start == 1, end == n)
+        columns = np.zeros((end - start, 3))
+        columns[:, 0] = rhs
+        columns[0, 1] = h[0] if start > 1 else 0.0
+        columns[-1, 2] = h[-1] if end < n else 0.0
+        return solve_tridiagonal(lower, diag, upper, columns)
+
+    def stream_coefficients(self, X, Y, out, chunk):
+        n = len(X) - 1
+        starts = list(range(1, n, chunk))
+        if n - starts[-1] < 3:
+            starts.pop()
+        ends = starts[1:] + [n]
+        blocks = len(starts)
+
+        # c_start = g0 - v0 c_{start-1} - w0 c_end and the same for c_{end-1};
+        # c_{start-1} is the last unknown of the previous block, c_end the first
+        # of the next one. Unknowns: first_0, last_0, first_1, last_1, ...
+        reduced = np.eye(2 * blocks)
+        rhs = np.zeros(2 * blocks)
+        for k, (start, end) in enumerate(zip(starts, ends)):
+            solutions = self.block_solutions(X, Y, n, start, end)
+            for row, i in ((2 * k, 0), (2 * k + 1, -1)):
+                g, v, w = solutions[i]
+                rhs[row] = g
+                if k > 0:
+                    reduced[row, 2 * k - 1] += v
+                if k < blocks - 1:
+                    reduced[row, 2 * k + 2] += w
+        ends_c = np.linalg.solve(reduced, rhs)
+
+        out[0] = X
+        out[1] = Y
+        c = out[3]
+        c[0] = c[n] = 0.0
+        for k, (start, end) in enumerate(zip(starts, ends)):
+            solutions = self.block_solutions(X, Y, n, start, end)
+            previous = ends_c[2 * k - 1] if k > 0 else 0.0
+            following = ends_c[2 * k + 2] if k < blocks - 1 else 0.0
+            c[start:end] = solutions[:, 0] - previous * solutions[:, 1] - following * solutions[:, 2]
+
+        # the end values only look at the first and the last three knots
+        head, tail = np.array(c[:3]), np.array(c[-3:])
+        ends_only = np.concatenate([head, tail])
+        self.end_values(ends_only, np.concatenate([np.diff(X[:3]), np.diff(X[-3:])]),
+                        np.concatenate([Y[:2], Y[-2:]]))
+        c[0], c[n] = ends_only[0], ends_only[-1]
+
+        b, d = out[2], out[4]
+        b[0] = d[0] = 0.0
+        for start in range(1, n + 1, chunk):
+            end = min(start + chunk, n + 1)
+            h = np.diff(np.array(X[start - 1:end]))
+            y = np.array(Y[start - 1:end])
+            c_block = np.array(c[start - 1:end])
+            d[start:end] = (c_block[1:] - c_block[:-1]) / (3 * h)
+            b[start:end] = (y[1:] - y[:-1]) / h + h * (2 * c_block[1:] + c_block[:-1]) / 3
+        # the constant piece left of x_0, as in getSpline
+        c[0] = 0.0
+
+    def derivative(self, order=1):
+        coeffs = self.coeffs
+        for _ in range(order):
+            coeffs = [k * coeffs[k] for k in range(1, len(coeffs))] or [np.zeros(len(self.x))]
+        return InterpolatedFunction.from_coefficients(self.x, coeffs)
+
+    def antiderivative(self):
+        # F(t) = integral of the spline from x_0 to t; constant past x_n,
+        # where the spline itself is taken to be zero
+        coeffs = [np.zeros(len(self.x))] + [coeff / (k + 1) for k, coeff in enumerate(self.coeffs)]
+        h = np.diff(self.x)
+        pieces = np.zeros(len(self.x) - 1)
+        for coeff in reversed(coeffs[1:]):
+            pieces = (pieces + coeff[1:]) * -h
+        coeffs[0] = np.concatenate([[0.0], -np.cumsum(pieces)])
+        return InterpolatedFunction.from_coefficients(self.x, coeffs, coeffs[0][-1])
+
     def calculate_interpolation_coeffs(self, tabulated_func_filename, points=None):
-        x = []
-        f = []
         if points is not None:
-            x = [point for point in points[0]]
-            f = [point for point in points[1]]
+            x = np.asarray(points[0], dtype=float)
+            f = np.asarray(points[1], dtype=float)
         else:
-            with open("tabulated_functions/" + tabulated_func_filename, 'r') as file:
-                for line in file:
-                    point = line.strip().split(' ')
-                    x.append(float(point[0]))
-                    f.append(float(point[1]))
-
+            x, f = storage.read_table("tabulated_functions/" + tabulated_func_filename)
 
         self.getSpline(x, f)
         return None
@@ -91,11 +320,113 @@ class InterpolatedFunction():
     def calculate(self, x):
         distribution = self.x
         indx = bisect.bisect_left(distribution, x)
-        if indx == len(distribution): return 0
+        if indx == len(distribution): return self.outside
+        # x_0 belongs to the first segment, not to the constant piece left of it
+        if indx == 0 and x == distribution[0]: indx = 1
         dx = x - self.x[indx]
-        return self.a[indx] + self.b[indx] * dx + self.c[indx] * dx**2 + self.d[indx] * dx**3
-        
+        value = 0
+        for coeff in reversed(self.coeffs):
+            value = value * dx + coeff[indx]
+        return value
+
+    def calculate_many(self, xs):
+        xs = np.asarray(xs, dtype=float)
+        indx = np.searchsorted(self.x, xs)
+        inside = indx < len(self.x)
+        indx = np.minimum(indx, len(self.x) - 1)
+        indx = np.where((indx == 0) & (xs == self.x[0]), 1, indx)
+        dx = xs - self.x[indx]
+        values = np.zeros(dx.shape)
+        for coeff in reversed(self.coeffs):
+            values = values * dx + coeff[indx]
+        return np.where(inside, values, self.outside)
+
     def tabulate(self, points, filename):
-        with open("tabulated_functions/" + filename, 'w') as f:
-            for x in points:
-                f.write("{} {}\n".format(x, self.calculate(x)))
\ No newline at end of file
+        points = np.asarray(points, dtype=float)
+        storage.write_table("tabulated_functions/" + filename, points, self.calculate_many(points))
+
+
+class SplineBatch():
+
+    # K cubic splines on one shared knot vector, fitted in one pass: the
+    # tridiagonal matrix depends on the knots only, so the K tables are the K
+    # right-hand side columns of a single solve_tridiagonal call. coeffs has
+    # shape (K, n + 1, 4) with the same segment layout as InterpolatedFunction
+    # (segment i covers [x_{i-1}, x_i] around x_i; segment 0 is the constant
+    # piece left of x_0), so coeffs[k, i, j] multiplies (t - x_i)^j.
+
+    def __init__(self, x, tables, bc_type="natural", bc_values=(0.0, 0.0)):
+        # tables: (K, n + 1) values at x; bc_values: one pair for all tables or
+        # one pair per table, (K, 2)
+        x = np.asarray(x, dtype=float)
+        y = np.atleast_2d(np.asarray(tables, dtype=float)).T
+        n = len(x) - 1
+        if n < 1:
+            raise ValueError("At least two knots are needed")
+        if y.shape[0] != n + 1:
+            raise ValueError("Every table needs {} values, one per knot".format(n + 1))
+        bc_values = np.asarray(bc_values, dtype=float)
+        if bc_values.ndim == 2:
+            bc_values = bc_values.T
+
+        h = np.diff(x)
+        fitter = InterpolatedFunction.__new__(InterpolatedFunction)
+        fitter.bc_type, fitter.bc_values = bc_type, bc_values
+        if n < 3:
+            c = np.zeros(y.shape)
+            for k in range(y.shape[1]):
+                fitter.bc_values = bc_values[:, k] if bc_values.ndim == 2 else bc_values
+                c[:, k] = fitter.short_table(n, h, y[:, k])
+        else:
+            c = np.zeros(y.shape)
+            lower, diag, upper, rhs = fitter.fill_in_matrix(n, h, y)
+            c[1:n] = solve_tridiagonal(lower, diag, upper, rhs)
+            fitter.end_values(c, h, y)
+
+        self.x = x
+        self.coeffs = np.zeros((y.shape[1], n + 1, 4))
+        self.coeffs[:, :, 0] = y.T
+        self.coeffs[:, :, 2] = c.T
+        self.coeffs[:, 1:, 3] = ((c[1:] - c[:-1]) / (3 * h[:, None])).T
+        self.coeffs[:, 1:, 1] = ((y[1:] - y[:-1]) / h[:, None] + h[:, None] * (2 * c[1:] + c[:-1]) / 3).T
+        self.coeffs[:, 0, 2] = 0.0
+        self.outside = 0.0
+
+    def __len__(self):
+        return len(self.coeffs)
+
+    def spline(self, k):
+        # table k as an InterpolatedFunction; the coefficients are views
+        return InterpolatedFunction.from_coefficients(self.x, list(self.coeffs[k].T), self.outside)
+
+    def __getitem__(self, k):
+        return self.spline(k)
+
+    def calculate_many(self, xs, which=None):
+        # values of the tables `which` (an index, a slice or an index array;
+        # all tables by default) at xs; shape (K', *xs.shape), or xs.shape for
+        # a single index
+        xs = np.asarray(xs, dtype=float)
+        coeffs = self.coeffs if which is None else self.coeffs[which]
+        indx = np.searchsorted(self.x, xs)
+        inside = indx < len(self.x)
+        indx = np.minimum(indx, len(self.x) - 1)
+        indx = np.where((indx == 0) & (xs == self.x[0]), 1, indx)
+        dx = xs - self.x[indx]
+        values = np.zeros(coeffs.shape[:-2] + dx.shape)
+        for j in range(3, -1, -1):
+            values = values * dx + coeffs[..., indx, j]
+        return np.where(inside, values, self.outside)
+
+    def calculate(self, x, which=None):
+        return self.calculate_many(x, which)
+
+    def derivative(self, order=1):
+        batch = SplineBatch.__new__(SplineBatch)
+        batch.x, batch.outside = self.x, 0.0
+        batch.coeffs = np.zeros(self.coeffs.shape)
+        if order < 4:
+            powers = np.arange(order, 4)
+            factors = np.prod([powers - m for m in range(order)], axis=0)
+            batch.coeffs[..., :4 - order] = self.coeffs[..., order:] * factors
+        return batch
@@ -1,3 +1,6 @@
+import numpy as np
+from functions import storage
+
 class PFunction():
 
     def __init__(self, params):
@@ -6,7 +9,9 @@ class PFunction():
     def calculate(self, w):
         return self.params[0] * w * (self.params[1] - w) 
 
+    def calculate_many(self, w):
+        return self.calculate(np.asarray(w, dtype=float))
+
     def tabulate(self, points, filename):
-        with open("tabulated_functions/" + filename, 'w') as f:
-            for x in points:
-                f.write("{} {}\n".format(x, self.calculate(x)))
\ No newline at end of file
+        points = np.asarray(points, dtype=float)
+        storage.write_table("tabulated_functions/" + filename, points, self.calculate_many(points))
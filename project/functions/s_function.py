@@ -1,4 +1,5 @@
 import numpy as np
+from functions import storage
 
 class SFunction():
 
@@ -8,7 +9,9 @@ class SFunction():
     def calculate(self, t):
         return self.params[0] * t + np.sin(t)
 
+    def calculate_many(self, t):
+        return self.calculate(np.asarray(t, dtype=float))
+
     def tabulate(self, points, filename):
-        with open("tabulated_functions/" + filename, 'w') as f:
-            for x in points:
-                f.write("{} {}\n".format(x, self.calculate(x)))
\ No newline at end of file
+        points = np.asarray(points, dtype=float)
+        storage.write_table("tabulated_functions/" + filename, points, self.calculate_many(points))
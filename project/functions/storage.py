@@ -0,0 +1,118 @@
+import contextlib
+import itertools
+import os
+import tempfile
+import numpy as np
+
+# Tables are stored either as text ("x value" per line) or as a .npy file
+# holding one float64 row per column, so every column is contiguous on disk
+# and can be memory-mapped without a copy.
+
+BINARY_EXTENSION = ".npy"
+CONVERTED_DIRECTORY = ".converted"
+
+
+def is_binary(path):
+    return path.endswith(BINARY_EXTENSION)
+
+
+def find_table(path):
+    # when both versions of a table exist, the one written last is used, so an
+    # edit of the text table is not hidden by an older binary export
+    binary = path + BINARY_EXTENSION
+    if not is_binary(path) and os.path.exists(binary):
+        if not os.path.exists(path) or os.stat(binary).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return binary
+    return path
+
+
+def write_table(path, *columns):
+    columns = [np.asarray(column, dtype=np.float64) for column in columns]
+    if is_binary(path):
+        np.save(path, np.vstack(columns))
+    else:
+        np.savetxt(path, np.column_stack(columns), fmt="%.17g")
+
+
+def read_table(path, mmap=True):
+    # returns the columns; binary tables are memory-mapped read-only
+    path = find_table(path)
+    if is_binary(path):
+        return tuple(np.load(path, mmap_mode="r" if mmap else None))
+    return tuple(np.loadtxt(path, ndmin=2).T)
+
+
+def text_chunks(path, rows):
+    # the rows of a text table, `rows` at a time, as (rows, columns) arrays
+    with open(path, 'r') as f:
+        while True:
+            lines = list(itertools.islice(f, rows))
+            if not lines:
+                break
+            block = np.loadtxt(lines, ndmin=2)
+            if len(block):
+                yield block
+
+
+def convert(source, target, rows=2**18):
+    # text -> .npy is streamed through a memory-mapped target, so tables of
+    # any length convert in constant memory
+    source = find_table(source)
+    if is_binary(source) or not is_binary(target):
+        write_table(target, *read_table(source))
+        return
+    count = count_rows(source)
+    out, filled = None, 0
+    for block in text_chunks(source, rows):
+        if out is None:
+            out = np.lib.format.open_memmap(target, mode="w+", dtype=np.float64, shape=(block.shape[1], count))
+        out[:, filled:filled + len(block)] = block.T
+        filled += len(block)
+    out.flush()
+
+
+def mapped(path, rows=2**18):
+    # A .npy version of the table that can be memory-mapped: the table itself
+    # when it is binary, otherwise a conversion kept in CONVERTED_DIRECTORY
+    # next to it and rebuilt whenever the text is newer. The conversion never
+    # takes the table's own name, so it cannot hide the text from find_table.
+    path = find_table(path)
+    if is_binary(path):
+        return path
+    directory, name = os.path.split(path)
+    target = os.path.join(directory, CONVERTED_DIRECTORY, name + BINARY_EXTENSION)
+    if not os.path.exists(target) or os.stat(target).st_mtime_ns < os.stat(path).st_mtime_ns:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with replacing(target) as temporary:
+            convert(path, temporary, rows)
+    return target
+
+
+@contextlib.contextmanager
+def replacing(target):
+    # a unique temporary .npy next to target that replaces it on success, so
+    # concurrent writers never truncate each other's memory-mapped files and
+    # readers never see a partial one
+    handle, temporary = tempfile.mkstemp(suffix=".tmp" + BINARY_EXTENSION, dir=os.path.dirname(target) or ".")
+    os.close(handle)
+    try:
+        yield temporary
+        os.replace(temporary, target)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def count_rows(path):
+    # rows of a table without loading it: the .npy header, or a pass over the text
+    path = find_table(path)
+    if is_binary(path):
+        return np.load(path, mmap_mode="r").shape[1]
+    with open(path, 'r') as f:
+        return sum(1 for line in f if line.strip())
+
+
+if __name__ == '__main__':
+    # python -m functions.storage <source> <target> converts text <-> .npy
+    import sys
+    convert(sys.argv[1], sys.argv[2])
@@ -0,0 +1,159 @@
+import collections
+import contextlib
+import functools
+import json
+import threading
+import time
+from functions import p_function, s_function, z_function, interpolated_function, integral, f_function
+from functions import expression_function
+
+# Opt-in counters and timing spans. While disabled, span() hands back a shared
+# no-op context manager and the function classes are untouched, so the hot
+# paths pay one global lookup per stage and nothing per evaluation. enable()
+# wraps calculate and calculate_many of the classes below to count calls per
+# object; disable() puts the original methods back.
+#
+#   instrumentation.enable()
+#   ... pipeline.Pipeline(...).fit().solve(...)
+#   print(instrumentation.summary())
+#   instrumentation.chrome_trace("trace.json")   # chrome://tracing, Perfetto
+
+CLASSES = (p_function.PFunction, s_function.SFunction, z_function.ZFunction,
+           interpolated_function.InterpolatedFunction, integral.Integral, f_function.FFunction,
+           expression_function.ExpressionFunction)
+METHODS = ("calculate", "calculate_many")
+
+enabled = False
+spans = []
+calls = collections.Counter()
+points = collections.Counter()
+labels = {}
+originals = {}
+null_span = contextlib.nullcontext()
+# ids of the objects inside a counted call, per thread
+local = threading.local()
+
+
+class Span():
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        spans.append((self.name, self.start, time.perf_counter() - self.start, threading.get_ident()))
+        return False
+
+
+def span(name):
+    if not enabled:
+        return null_span
+    return Span(name)
+
+
+def label(obj, name):
+    # names an object in the counters, e.g. the p, z and s splines
+    if enabled:
+        labels[id(obj)] = name
+        if isinstance(obj, integral.Integral):
+            label_table(obj)
+
+
+def object_name(obj):
+    return labels.get(id(obj), "{}@{:x}".format(type(obj).__name__, id(obj) & 0xffffff))
+
+
+def label_table(obj):
+    # the spline behind an Integral's table is counted as "<integral> table"
+    if obj.method == "table":
+        if obj.table is None:
+            obj.build_table()
+        if obj.table[0] == "spline" and id(obj.table[1]) not in labels:
+            labels[id(obj.table[1])] = object_name(obj) + " table"
+
+
+def counting(method):
+    # only the outermost call per object is counted, so calculate and
+    # calculate_many delegating to each other count once
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        active = getattr(local, "active", None)
+        if active is None:
+            active = local.active = set()
+        if id(self) in active:
+            return method(self, *args, **kwargs)
+        if isinstance(self, integral.Integral):
+            label_table(self)
+        key = (object_name(self), method.__name__)
+        calls[key] += 1
+        if method.__name__ == "calculate_many" and args:
+            points[key] += getattr(args[0], "size", 1)
+        active.add(id(self))
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            active.discard(id(self))
+    return wrapper
+
+
+def reset():
+    del spans[:]
+    calls.clear()
+    points.clear()
+    labels.clear()
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    reset()
+    for cls in CLASSES:
+        for name in METHODS:
+            if name in cls.__dict__:
+                originals[(cls, name)] = cls.__dict__[name]
+                setattr(cls, name, counting(cls.__dict__[name]))
+    enabled = True
+
+
+def disable():
+    global enabled
+    for (cls, name), method in originals.items():
+        setattr(cls, name, method)
+    originals.clear()
+    enabled = False
+
+
+def span_totals():
+    # name -> (count, total seconds, max seconds)
+    totals = collections.OrderedDict()
+    for name, start, duration, thread in spans:
+        count, total, longest = totals.get(name, (0, 0.0, 0.0))
+        totals[name] = (count + 1, total + duration, max(longest, duration))
+    return totals
+
+
+def summary():
+    lines = ["{:<24} {:>8} {:>12} {:>12} {:>12}".format("span", "count", "total, s", "mean, ms", "max, ms")]
+    for name, (count, total, longest) in span_totals().items():
+        lines.append("{:<24} {:>8} {:>12.4f} {:>12.3f} {:>12.3f}".format(
+            name, count, total, 1e3 * total / count, 1e3 * longest))
+    lines.append("")
+    lines.append("{:<32} {:<16} {:>12} {:>14}".format("object", "method", "calls", "points"))
+    for (name, method), count in sorted(calls.items(), key=lambda item: -item[1]):
+        lines.append("{:<32} {:<16} {:>12} {:>14}".format(name, method, count, points.get((name, method), "")))
+    return "\n".join(lines)
+
+
+def chrome_trace(filename):
+    # Trace Event Format: one complete ("X") event per span, times in us
+    origin = min((start for _, start, _, _ in spans), default=0.0)
+    events = [{"name": name, "ph": "X", "pid": 0, "tid": thread,
+               "ts": 1e6 * (start - origin), "dur": 1e6 * duration}
+              for name, start, duration, thread in spans]
+    counters = {"{}.{}".format(name, method): count for (name, method), count in calls.items()}
+    with open(filename, 'w') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"calls": counters}}, f)
@@ -1,7 +1,45 @@
+import os
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
+from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtWidgets import (QWidget, QLabel, QLineEdit, 
-    QGridLayout, QApplication, QPushButton, QComboBox)
+    QGridLayout, QApplication, QPushButton, QComboBox, QProgressBar)
+import Solver
+import instrumentation
+from functions import storage
+
+
+class SolveWorker(QThread):
+
+    # Runs click_function off the Qt event loop. The results come back through
+    # signals, which Qt delivers on the GUI thread.
+    progress = pyqtSignal(str, float)
+    snapshot = pyqtSignal(object)
+    done = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, function, args, kwargs):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    def report(self, text, fraction=None, snapshot=None):
+        if self.cancelled:
+            raise Solver.Cancelled()
+        self.progress.emit(text, -1.0 if fraction is None else fraction)
+        if snapshot is not None:
+            self.snapshot.emit(snapshot)
+
+    def run(self):
+        try:
+            self.done.emit(self.function(*self.args, progress=self.report, draw=False, **self.kwargs))
+        except Solver.Cancelled:
+            self.failed.emit("Отменено")
+        except Exception as error:
+            self.failed.emit("Ошибка: {}".format(error))
 
 
 class Window(QWidget):
@@ -15,6 +53,7 @@ class Window(QWidget):
     beta_edit = None
     beta_edit_end = None
     T_edit = None
+    tolerance_edit = None
     info_text = None
     convertion_error_text = "Проверьте правильность ввода"
     open_error_text = "Проверьте файлы"
@@ -24,6 +63,10 @@ class Window(QWidget):
         super().__init__()
 
         self.click_function = click_function
+        # queued runs start one after another; every run gets its own figure
+        self.queue = []
+        self.worker = None
+        self.runs = 0
         self.initUI()
 
 
@@ -62,10 +105,21 @@ class Window(QWidget):
         self.T_descr = QLabel("T: ")
         self.T_edit = QLineEdit()
 
+        self.tolerance_descr = QLabel("Точность beta: ")
+        self.tolerance_edit = QLineEdit()
+        self.tolerance_edit.setPlaceholderText("1e-6")
+
     
         submit_btn = QPushButton("Решить", self)
         submit_btn.clicked.connect(self.on_button_click)
 
+        self.cancel_btn = QPushButton("Отмена", self)
+        self.cancel_btn.clicked.connect(self.on_cancel_click)
+        self.cancel_btn.setEnabled(False)
+
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 100)
+
         comboBox = QComboBox(self)
         comboBox.addItem("Авто")
         comboBox.addItem("Ручной")
@@ -99,12 +153,17 @@ class Window(QWidget):
         grid.addWidget(self.beta_edit, 11, 1)
         grid.addWidget(self.beta_edit_end, 12, 1)
         grid.addWidget(self.T_edit, 13, 1)
+        grid.addWidget(self.tolerance_descr, 14, 0)
+        grid.addWidget(self.tolerance_edit, 14, 1)
 
-        grid.addWidget(submit_btn, 14, 0)
+        grid.addWidget(submit_btn, 15, 0)
 
-        grid.addWidget(comboBox, 14, 1)
+        grid.addWidget(comboBox, 15, 1)
 
-        grid.addWidget(self.info_text, 15, 0)
+        grid.addWidget(self.cancel_btn, 16, 0)
+        grid.addWidget(self.progress_bar, 16, 1)
+
+        grid.addWidget(self.info_text, 17, 0, 1, 2)
 
         self.setLayout(grid)
 
@@ -129,27 +188,25 @@ class Window(QWidget):
 
             self.info_text.setText('')
             if self.calculating_mod == "Ручной":
-                self.click_function(a, b, c, d, x_0, y_0, beta, T, self.calculating_mod)
+                self.submit(a, b, c, d, x_0, y_0, beta, T, self.calculating_mod)
             else:
                 try:
                     beta_end = float(self.beta_edit_end.text())
+                    tolerance = float(self.tolerance_edit.text() or 1e-6)
                 except:
                     self.info_text.setText(self.convertion_error_text)
                     return
-                self.click_function(a, b, c, d, x_0, y_0, [beta, beta_end], T, self.calculating_mod)
+                self.submit(a, b, c, d, x_0, y_0, [beta, beta_end], T, self.calculating_mod,
+                                    tolerance=tolerance)
         else:
             a = None
             b = None
             d = None
             c = None
-            try:
-                with open('tabulated_functions/p_func_tabulated', 'r') as k, \
-                     open('tabulated_functions/z_func_tabulated', 'r') as l, \
-                     open('tabulated_functions/s_func_tabulated', 'r') as m:
-                        pass
-            except:
-                self.info_text.setText(self.open_error_text)
-                return
+            for name in ('p', 'z', 's'):
+                if not os.path.exists(storage.find_table('tabulated_functions/{}_func_tabulated'.format(name))):
+                    self.info_text.setText(self.open_error_text)
+                    return
             try:
                 x_0 = float(self.x_0_edit.text())
                 y_0 = float(self.y_0_edit.text())
@@ -160,14 +217,55 @@ class Window(QWidget):
                 return
             self.info_text.setText('')
             if self.calculating_mod == "Ручной+файл":
-                self.click_function(a, b, c, d, x_0, y_0, beta, T, self.calculating_mod)
+                self.submit(a, b, c, d, x_0, y_0, beta, T, self.calculating_mod)
             else:
                 try:
                     beta_end = float(self.beta_edit_end.text())
+                    tolerance = float(self.tolerance_edit.text() or 1e-6)
                 except:
                     self.info_text.setText(self.convertion_error_text)
                     return
-                self.click_function(a, b, c, d, x_0, y_0, [beta, beta_end], T, self.calculating_mod)
+                self.submit(a, b, c, d, x_0, y_0, [beta, beta_end], T, self.calculating_mod,
+                                    tolerance=tolerance)
+
+    def submit(self, *args, **kwargs):
+        self.runs += 1
+        self.queue.append((self.runs, args, kwargs))
+        if self.worker is None:
+            self.start_next()
+        else:
+            self.info_text.setText("В очереди: {}".format(len(self.queue)))
+
+    def start_next(self):
+        if not self.queue:
+            self.worker = None
+            self.cancel_btn.setEnabled(False)
+            return
+        figure, args, kwargs = self.queue.pop(0)
+        self.worker = SolveWorker(self.click_function, args, kwargs)
+        self.worker.progress.connect(self.on_progress)
+        self.worker.snapshot.connect(lambda run: draw_graphics(run, figure, block=False))
+        self.worker.done.connect(lambda run: self.on_done(run, figure))
+        self.worker.failed.connect(self.on_failed)
+        self.worker.finished.connect(self.start_next)
+        self.cancel_btn.setEnabled(True)
+        self.worker.start()
+
+    def on_progress(self, text, fraction):
+        self.info_text.setText(text)
+        if fraction >= 0:
+            self.progress_bar.setValue(int(fraction * 100))
+
+    def on_done(self, run, figure):
+        self.info_text.setText("beta = {:.6g}: c1 = {:.6g}, c2 = {:.6g}".format(run.beta, run.c1, run.c2))
+        draw_graphics(run, figure, block=False)
+
+    def on_failed(self, text):
+        self.info_text.setText(text)
+
+    def on_cancel_click(self):
+        if self.worker is not None:
+            self.worker.cancelled = True
 
     def update_calculating_mod(self, mod_text):
         self.calculating_mod = mod_text
@@ -184,6 +282,8 @@ class Window(QWidget):
             self.z_edit.setHidden(False)
             self.s_edit.setHidden(False)
             self.beta_edit_end.setHidden(True)
+            self.tolerance_descr.setHidden(True)
+            self.tolerance_edit.setHidden(True)
         elif mod_text == "Авто":
             self.p_par_descr_a.setHidden(False)
             self.p_par_descr_b.setHidden(False)
@@ -197,6 +297,8 @@ class Window(QWidget):
             self.z_edit.setHidden(False)
             self.s_edit.setHidden(False)
             self.beta_edit_end.setHidden(False)
+            self.tolerance_descr.setHidden(False)
+            self.tolerance_edit.setHidden(False)
         else:
             if mod_text == "Ручной+файл":
                 self.p_par_descr_a.setHidden(True)
@@ -211,6 +313,8 @@ class Window(QWidget):
                 self.z_edit.setHidden(True)
                 self.s_edit.setHidden(True)
                 self.beta_edit_end.setHidden(True)
+                self.tolerance_descr.setHidden(True)
+                self.tolerance_edit.setHidden(True)
             else:
                 self.p_par_descr_a.setHidden(True)
                 self.p_par_descr_b.setHidden(True)
@@ -224,80 +328,84 @@ class Window(QWidget):
                 self.z_edit.setHidden(True)
                 self.s_edit.setHidden(True)
                 self.beta_edit_end.setHidden(False)
-
-
-def draw_graphics(beta, c1, c2):
-    fig = plt.figure(1)
-    fig.suptitle('beta = {}, c1 = {},  c2 = {}'.format(beta, c1, c2), fontsize=12,)
-    t_x, x = [], []
-    with open("x_answer.txt", 'r') as f:
-        for line in f:
-            data = line.split(' ')
-            t_x.append(float(data[0]))
-            x.append(float(data[1]))
-    plt.subplot(231)
-    plt.plot(t_x, x)
-    plt.title('x(t)')
-
-    t_s, t_s_interp, s, s_interp = [], [], [], []
-    with open("tabulated_functions/s_func_tabulated", 'r') as f:
-        for line in f:
-            data = line.split(' ')
-            t_s.append(float(data[0]))
-            s.append(float(data[1]))
-    with open("tabulated_functions/s_func_interp_tabulated", 'r') as f:
-        for line in f:
-            data = line.split(' ')
-            t_s_interp.append(float(data[0]))
-            s_interp.append(float(data[1]))
-    plt.subplot(232)
-    plt.plot(t_s, s, t_s_interp, s_interp)
-    plt.title('S(t)')
-
-    x_s = [x[i] - s[i] for i in range(0, len(t_x))]
-    plt.subplot(233)
-    plt.plot(t_x, x_s)
-    plt.title('x(t) - S(t)')
-
-    t_y, y, = [], []
-    with open("y_answer.txt", 'r') as f:
-        for line in f:
-            data = line.split(' ')
-            t_y.append(float(data[0]))
-            y.append(float(data[1]))
-    plt.subplot(234)
-    plt.plot(t_y, y)
-    plt.title('y(t)')
-
-    t_p, t_p_interp, p, p_interp = [], [], [], []
-    with open("tabulated_functions/p_func_tabulated", 'r') as f:
-        for line in f:
-            data = line.split(' ')
-            t_p.append(float(data[0]))
-            p.append(float(data[1]))
-    with open("tabulated_functions/p_func_interp_tabulated", 'r') as f:
-        for line in f:
-            data = line.split(' ')
-            t_p_interp.append(float(data[0]))
-            p_interp.append(float(data[1]))
-    plt.subplot(235)
-    plt.plot(t_p, p, t_p_interp, p_interp)
-    plt.title('p(w)')
-
-    t_z, t_z_interp, z, z_interp = [], [], [], []
-    with open("tabulated_functions/z_func_tabulated", 'r') as f:
-        for line in f:
-            data = line.split(' ')
-            t_z.append(float(data[0]))
-            z.append(float(data[1]))
-    with open("tabulated_functions/z_func_interp_tabulated", 'r') as f:
-        for line in f:
-            data = line.split(' ')
-            t_z_interp.append(float(data[0]))
-            z_interp.append(float(data[1]))
-    plt.subplot(236)
-    plt.plot(t_z, z, t_z_interp, z_interp)
-    plt.title('z(t)')
-
-
-    plt.show()
\ No newline at end of file
+                self.tolerance_descr.setHidden(False)
+                self.tolerance_edit.setHidden(False)
+
+
+def decimate(t, values, bins):
+    # keeps the smallest and the largest value of every one of `bins` equal
+    # runs of points, in their original order, so peaks survive at any length
+    t, values = np.asarray(t), np.asarray(values)
+    if len(t) <= 4 * bins:
+        return t, values
+    size = len(t) // bins
+    body = values[:size * bins].reshape(bins, size)
+    offsets = np.arange(bins)[:, None] * size
+    picks = (np.stack([body.argmin(axis=1), body.argmax(axis=1)], axis=1) + offsets).ravel()
+    tail = np.arange(size * bins, len(t))
+    if len(tail):
+        picks = np.concatenate([picks, [tail[values[tail].argmin()], tail[values[tail].argmax()]]])
+    picks = np.unique(np.concatenate([[0], picks, [len(t) - 1]]))
+    return t[picks], values[picks]
+
+
+# samples of the dense output per trajectory panel, a few per pixel of a
+# panel; trajectories with at least this many nodes are not resampled
+DENSE_POINTS = 2000
+
+
+def graphics_series(run):
+    # (subplot, title, [(t, values), ...]) for the six panels; when the nodes
+    # are sparse, as for rk45, x and y are filled in from the dense output.
+    # Dense nodes are drawn as they are and left to the decimation.
+    solution = run.solution
+    t_x, x, y = solution.t, solution.x, solution.y
+    if solution.dx is not None and len(t_x) < DENSE_POINTS:
+        t_x = np.union1d(t_x, np.linspace(t_x[0], t_x[-1], DENSE_POINTS))
+        x, y = solution.calculate_many(t_x)
+    x_s = x - run.splines["s"].calculate_many(t_x)
+    return [(231, 'x(t)', [(t_x, x)]),
+            (232, 'S(t)', [run.tables["s"], run.interpolated_table("s")]),
+            (233, 'x(t) - S(t)', [(t_x, x_s)]),
+            (234, 'y(t)', [(t_x, y)]),
+            (235, 'p(w)', [run.tables["p"], run.interpolated_table("p")]),
+            (236, 'z(t)', [run.tables["z"], run.interpolated_table("z")])]
+
+
+# figure number -> its line artists, so later runs update them in place
+figure_lines = {}
+
+
+def draw_graphics(run, figure=1, block=True):
+    # Every line is decimated to about two points per pixel of its axes. A
+    # figure that is still open keeps its axes and lines and only gets new
+    # data, which is what lets an auto run be watched live.
+    with instrumentation.span("plot"):
+        if not run.splines:
+            # a cached solve skips the spline fitting
+            run.fit()
+        fresh = figure not in figure_lines or not plt.fignum_exists(figure)
+        fig = plt.figure(figure)
+        if fresh:
+            fig.clf()
+            figure_lines[figure] = []
+        fig.suptitle('beta = {}, c1 = {},  c2 = {}'.format(run.beta, run.c1, run.c2), fontsize=12,)
+        for k, (position, title, series) in enumerate(graphics_series(run)):
+            if fresh:
+                axes = plt.subplot(position)
+                axes.set_title(title)
+                figure_lines[figure].append(axes.plot(*[[] for _ in range(2 * len(series))]))
+            lines = figure_lines[figure][k]
+            axes = lines[0].axes
+            bins = max(100, int(axes.bbox.width))
+            for line, (t, values) in zip(lines, series):
+                line.set_data(*decimate(t, values, bins))
+            axes.relim()
+            axes.autoscale_view()
+
+    # outside the span: a blocking show lasts until the window is closed
+    if block:
+        plt.show()
+    else:
+        plt.show(block=False)
+        fig.canvas.draw_idle()
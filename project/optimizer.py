@@ -0,0 +1,142 @@
+import math
+
+GOLDEN = (3 - math.sqrt(5)) / 2
+
+
+class Memoized():
+
+    # caches the values of a scalar function so no point is computed twice
+    def __init__(self, func):
+        self.func = func
+        self.values = {}
+
+    def __call__(self, x):
+        if x not in self.values:
+            self.values[x] = self.func(x)
+        return self.values[x]
+
+    @property
+    def evaluations(self):
+        return len(self.values)
+
+
+def golden_section(func, left, right, tol=1e-6, max_iterations=500):
+    # every iteration reuses one of the two inner points
+    x1 = left + GOLDEN * (right - left)
+    x2 = right - GOLDEN * (right - left)
+    f1, f2 = func(x1), func(x2)
+    for _ in range(max_iterations):
+        if right - left <= tol:
+            break
+        if f1 >= f2:
+            left, x1, f1 = x1, x2, f2
+            x2 = right - GOLDEN * (right - left)
+            f2 = func(x2)
+        else:
+            right, x2, f2 = x2, x1, f1
+            x1 = left + GOLDEN * (right - left)
+            f1 = func(x1)
+    return (x1, f1) if f1 < f2 else (x2, f2)
+
+
+def brent(func, left, right, tol=1e-6, max_iterations=500):
+    # Brent's method: parabolic interpolation through the three best points,
+    # falling back to a golden-section step when the parabola is not trusted
+    x = w = v = left + GOLDEN * (right - left)
+    fx = fw = fv = func(x)
+    d = e = 0.0
+    for _ in range(max_iterations):
+        middle = (left + right) / 2
+        tol1 = tol / 3 + 1e-12 * abs(x)
+        tol2 = 2 * tol1
+        if abs(x - middle) <= tol2 - (right - left) / 2:
+            break
+        parabolic = False
+        if abs(e) > tol1:
+            r = (x - w) * (fx - fv)
+            q = (x - v) * (fx - fw)
+            p = (x - v) * q - (x - w) * r
+            q = 2 * (q - r)
+            if q > 0:
+                p = -p
+            q = abs(q)
+            if abs(p) < abs(q * e / 2) and q * (left - x) < p < q * (right - x):
+                e, d = d, p / q
+                u = x + d
+                if u - left < tol2 or right - u < tol2:
+                    d = tol1 if middle >= x else -tol1
+                parabolic = True
+        if not parabolic:
+            e = (right - x) if x < middle else (left - x)
+            d = GOLDEN * e
+        u = x + (d if abs(d) >= tol1 else (tol1 if d > 0 else -tol1))
+        fu = func(u)
+        if fu <= fx:
+            if u < x:
+                right = x
+            else:
+                left = x
+            v, fv, w, fw, x, fx = w, fw, x, fx, u, fu
+        else:
+            if u < x:
+                left = u
+            else:
+                right = u
+            if fu <= fw or w == x:
+                v, fv, w, fw = w, fw, u, fu
+            elif fu <= fv or v == x or v == w:
+                v, fv = u, fu
+    return x, fx
+
+
+def secant(func, left, right, tol=1e-6, max_iterations=100):
+    # func returns (f, f'). Secant steps on f' inside a bracket where f'
+    # changes sign from - to +, bisecting when a step leaves the bracket or
+    # two steps in a row failed to halve it
+    f_left, g_left = func(left)
+    f_right, g_right = func(right)
+    if g_left >= 0:
+        return left, f_left
+    if g_right <= 0:
+        return right, f_right
+    x0, g0, x1, g1 = left, g_left, right, g_right
+    best = (left, f_left) if f_left < f_right else (right, f_right)
+    width, stalls = right - left, 0
+    for _ in range(max_iterations):
+        if right - left <= tol:
+            break
+        u = x1 - g1 * (x1 - x0) / (g1 - g0) if g1 != g0 else left
+        if not (left < u < right) or stalls >= 2:
+            u, stalls = (left + right) / 2, 0
+        fu, gu = func(u)
+        if fu < best[1]:
+            best = (u, fu)
+        if gu == 0 or abs(u - x1) <= tol / 2:
+            break
+        if gu > 0:
+            right = u
+        else:
+            left = u
+        x0, g0, x1, g1 = x1, g1, u, gu
+        if right - left > width / 2:
+            stalls += 1
+        else:
+            width, stalls = right - left, 0
+    return best
+
+
+METHODS = {"golden": golden_section, "brent": brent}
+# methods that need func to return (f, f')
+GRADIENT_METHODS = {"secant": secant}
+
+
+def minimize(func, left, right, tol=1e-6, method="brent"):
+    # returns (x, f(x), number of distinct evaluations); for the gradient
+    # methods func returns (f, f')
+    # the bracket may be given in either order, e.g. as typed in the GUI
+    left, right = min(left, right), max(left, right)
+    if left == right:
+        raise ValueError("The bracket [{}, {}] is empty".format(left, right))
+    memoized = Memoized(func)
+    x, fx = {**METHODS, **GRADIENT_METHODS}[method](memoized, left, right, tol)
+    return x, fx, memoized.evaluations
@@ -0,0 +1,277 @@
+import os
+import numpy as np
+import Solver
+import instrumentation
+import metrics
+from functions import z_function, p_function, s_function, integral, interpolated_function, f_function, storage
+from functions import expression_function
+
+FUNCTION_NAMES = ("p", "z", "s")
+# the variable each function is written in, as in expression_functions()
+FUNCTION_VARIABLES = {"p": "w", "z": "t", "s": "t"}
+# file tables longer than this are fitted out of core, see InterpolatedFunction.stream
+STREAMING_KNOTS = 2**21
+
+
+def initialize_functions(a, b, c, d):
+    p_func = p_function.PFunction([a, b])
+    z_func = z_function.ZFunction([c])
+    s_func = s_function.SFunction([d])
+
+    return p_func, z_func, s_func
+
+
+def expression_functions(a, b, c, d):
+    # the same p, z, s as vectorized expressions, for Pipeline(functions=...)
+    return {"p": expression_function.ExpressionFunction("a * w * (b - w)", "w", {"a": a, "b": b}),
+            "z": expression_function.ExpressionFunction("c * t + cos(t)", "t", {"c": c}),
+            "s": expression_function.ExpressionFunction("d * t + sin(t)", "t", {"d": d})}
+
+
+def user_functions(specs, a=None, b=None, c=None, d=None):
+    # specs maps some of "p", "z", "s" to an expression string, or to a dict
+    # {"expression": ..., "params": {...}, "variable": ...}; the expressions
+    # may use a, b, c, d (those given) and their own params, e.g.
+    #   {"p": "a * w * (b - w)", "z": {"expression": "k * t", "params": {"k": 2}}}
+    functions = {}
+    for name, spec in (specs or {}).items():
+        if name not in FUNCTION_VARIABLES:
+            raise ValueError("Only {} can be given as expressions, not {!r}".format(", ".join(FUNCTION_NAMES), name))
+        if isinstance(spec, str):
+            spec = {"expression": spec}
+        params = {key: value for key, value in zip("abcd", (a, b, c, d)) if value is not None}
+        params.update(spec.get("params") or {})
+        functions[name] = expression_function.ExpressionFunction(
+            spec["expression"], spec.get("variable", FUNCTION_VARIABLES[name]), params)
+    return functions
+
+
+class Pipeline():
+
+    # Tabulation -> spline fitting -> solving, with NumPy arrays passed
+    # between the stages. Nothing is written to disk unless export() is called.
+    # functions maps some of "p", "z", "s" to objects with calculate_many (and
+    # derivative for z), e.g. from expression_functions(); those are used by
+    # the solver as they are instead of through a spline of their table.
+
+    def __init__(self, a, b, c, d, T, calculating_mod, N=50, directory="tabulated_functions", cache=None,
+                 functions=None):
+        self.params = [a, b, c, d]
+        self.T = T
+        self.N = N
+        self.calculating_mod = calculating_mod
+        self.directory = directory
+        self.cache = cache
+        self.functions = dict(functions or {})
+        self.tables = {}
+        self.sources = {}
+        self.splines = {}
+        self.interpolated_tables = {}
+        self.solution = None
+        self.beta = self.c1 = self.c2 = None
+        # the inputs are fixed for a pipeline, so solves are memoized by their arguments
+        self.results = {}
+
+    def tabulate(self):
+        with instrumentation.span("tabulate"):
+            if self.calculating_mod == "Ручной" or self.calculating_mod == "Авто":
+                grid = np.linspace(0, self.T, self.N + 1)
+                functions = initialize_functions(*self.params)
+                for name, func in zip(FUNCTION_NAMES, functions):
+                    if name in self.functions:
+                        continue
+                    instrumentation.label(func, name.upper())
+                    self.tables[name] = (grid, func.calculate_many(grid))
+            else:
+                # a table that fit() will stream is never read whole: a text
+                # one is converted to .npy in constant memory and memory-mapped
+                for name in FUNCTION_NAMES:
+                    if name not in self.functions:
+                        path = storage.find_table(os.path.join(self.directory, name + "_func_tabulated"))
+                        if not storage.is_binary(path) and storage.count_rows(path) > STREAMING_KNOTS:
+                            path = storage.mapped(path)
+                        self.tables[name] = storage.read_table(path)
+                        self.sources[name] = path
+            grid = np.linspace(0, self.T, self.N + 1)
+            for name, func in self.functions.items():
+                instrumentation.label(func, name)
+                self.tables[name] = (grid, func.calculate_many(grid))
+        return self
+
+    def streamed(self, name):
+        return (self.calculating_mod not in ("Ручной", "Авто") and name not in self.functions
+                and len(self.tables[name][0]) > STREAMING_KNOTS)
+
+    def fit(self):
+        if not self.tables:
+            self.tabulate()
+        with instrumentation.span("fit"):
+            for name in FUNCTION_NAMES:
+                if name in self.functions:
+                    self.splines[name] = self.functions[name]
+                    continue
+                if self.streamed(name):
+                    table = os.path.join(self.directory, name + "_func_tabulated")
+                    store = os.path.join(self.directory, name + "_func_spline" + storage.BINARY_EXTENSION)
+                    spline = interpolated_function.InterpolatedFunction.stream(table, store)
+                else:
+                    spline = interpolated_function.InterpolatedFunction(None, self.tables[name], cache=self.cache)
+                instrumentation.label(spline, name)
+                self.splines[name] = spline
+            self.integral_p = integral.Integral(self.splines["p"])
+            self.inner = metrics.inner_integral(self.splines["p"])
+            instrumentation.label(self.integral_p, "u")
+            instrumentation.label(self.inner, "inner")
+        return self
+
+    def interpolated_table(self, name):
+        # the fitted function on a grid 100 times finer than the table, for
+        # plotting and export only, so it is built on first use
+        if name not in self.interpolated_tables:
+            if not self.splines:
+                self.fit()
+            grid = np.linspace(0, self.T, self.N * 100 + 1)
+            self.interpolated_tables[name] = (grid, self.splines[name].calculate_many(grid))
+        return self.interpolated_tables[name]
+
+    def solve(self, x_0, y_0, beta, method="rk4", progress=None, **kwargs):
+        key = (x_0, y_0, beta, method, tuple(sorted(kwargs.items())))
+        if key not in self.results:
+            with instrumentation.span("solve"):
+                self.results[key] = self.cached_solve(x_0, y_0, beta, method, kwargs, progress)
+        self.c1, self.c2, self.solution = self.results[key]
+        self.beta = beta
+        return self.c1, self.c2
+
+    def table_key(self, name):
+        # what identifies a table in the solve cache key: its contents, or
+        # for a streamed one the converted file, which is not read for it
+        if self.streamed(name):
+            stat = os.stat(self.sources[name])
+            return [os.path.abspath(self.sources[name]), stat.st_size, str(stat.st_mtime_ns)]
+        return [np.asarray(column, dtype=float) for column in self.tables[name]]
+
+    def cached_solve(self, x_0, y_0, beta, method, kwargs, progress=None):
+        name = None
+        if self.cache is not None:
+            if not self.tables:
+                self.tabulate()
+            tables = [part for n in FUNCTION_NAMES for part in self.table_key(n)]
+            # a function used as it is gives other results than a spline of the same table
+            exact = [sorted((n, repr(func)) for n, func in self.functions.items())] if self.functions else []
+            name = self.cache.key("solve", *tables, x_0, y_0, beta, self.T, self.N, method, sorted(kwargs.items()),
+                                  *exact)
+            entry = self.cache.get(name)
+            if entry is not None:
+                solution = Solver.Solution(entry["t"], entry["x"], entry["y"], entry["dx"], entry["dy"])
+                return entry["c"][0], entry["c"][1], solution
+
+        if not self.splines:
+            self.fit()
+        p, z, s = self.splines["p"], self.splines["z"], self.splines["s"]
+        f_func = f_function.FFunction([beta, s, z, self.N])
+        instrumentation.label(f_func, "f")
+        c1, c2, solution = Solver.solve(x_0, y_0, beta, self.T, self.N, p, z, s, self.integral_p,
+                                        f_func, method=method, return_solution=True, inner=self.inner,
+                                        progress=progress, **kwargs)
+        if name is not None:
+            self.cache.put(name, {"t": solution.t, "x": solution.x, "y": solution.y,
+                                  "dx": solution.dx, "dy": solution.dy, "c": np.array([c1, c2])})
+        return c1, c2, solution
+
+    def partial_tables(self, wrt):
+        # tables of dp, dz, ds along one of the analytic parameters a, b, c, d
+        a, b, c, d = self.params
+        grid = self.tables["p"][0]
+        partials = {"a": ("p", grid * (b - grid)), "b": ("p", a * grid),
+                    "c": ("z", grid), "d": ("s", grid)}
+        if wrt not in partials:
+            raise ValueError("Unknown parameter: {}".format(wrt))
+        if not (self.calculating_mod == "Ручной" or self.calculating_mod == "Авто"):
+            raise ValueError("Tabulated functions have no parameters")
+        name, values = partials[wrt]
+        return {name: interpolated_function.InterpolatedFunction(None, (grid, values))}
+
+    def gradient(self, x_0, y_0, beta, wrt="beta"):
+        # c1, c2 and their derivatives along beta or one of a, b, c, d,
+        # from the forward sensitivity equations
+        if not self.splines:
+            self.fit()
+        p, z, s = self.splines["p"], self.splines["z"], self.splines["s"]
+        partials = {} if wrt == "beta" else self.partial_tables(wrt)
+        with instrumentation.span("gradient"):
+            self.c1, self.c2, dc1, dc2, self.solution, sensitivity = Solver.solve_sensitivity(
+                x_0, y_0, beta, self.T, self.N, p, z, s, self.integral_p,
+                partials.get("p"), partials.get("z"), partials.get("s"), 1.0 if wrt == "beta" else 0.0, self.inner)
+        self.beta = beta
+        return self.c1, self.c2, dc1, dc2
+
+    def inputs(self, beta):
+        # what the rk4 steps read, for Solver.unchanged_steps
+        return (beta, Solver.z_derivative(self.splines["z"], self.T, self.N), self.splines["s"], self.integral_p)
+
+    def continue_solve(self, x_0, y_0, beta, resume, checkpoint=None):
+        p, z, s = self.splines["p"], self.splines["z"], self.splines["s"]
+        f_func = f_function.FFunction([beta, s, z, self.N])
+        with instrumentation.span("solve"):
+            c1, c2, solution = Solver.solve(x_0, y_0, beta, self.T, self.N, p, z, s, self.integral_p, f_func,
+                                            return_solution=True, inner=self.inner, resume=resume,
+                                            checkpoint=checkpoint)
+        self.results[(x_0, y_0, beta, "rk4", ())] = (c1, c2, solution)
+        self.c1, self.c2, self.solution, self.beta = c1, c2, solution, beta
+        return c1, c2
+
+    def extend(self, T, x_0, y_0, beta):
+        # Re-solves (x_0, y_0, beta) up to a longer horizon T with the same
+        # step. The tables and splines are rebuilt for the new T; the steps
+        # of the previous trajectory whose inputs did not change are kept and
+        # the integration restarts from the first one that did.
+        step = self.T / self.N
+        N = int(round(T / step))
+        if N < self.N or not np.isclose(N * step, T, rtol=1e-12, atol=0):
+            raise ValueError("T has to extend the horizon by whole steps of {}".format(step))
+        if not self.splines:
+            self.fit()
+        self.solve(x_0, y_0, beta)
+        old_solution, old_inputs = self.solution, self.inputs(beta)
+
+        self.T, self.N = T, N
+        p_table = self.tables["p"]
+        self.tables, self.splines, self.interpolated_tables, self.results = {}, {}, {}, {}
+        self.tabulate()
+        if p_table[0][-1] >= 1:
+            # p is a function of w on [0, 1], not of t: a table that already
+            # covers [0, 1] is kept, so u and the start of the trajectory stay
+            self.tables["p"] = p_table
+        self.fit()
+        kept = Solver.unchanged_steps(old_solution, old_inputs, self.inputs(beta))
+        return self.continue_solve(x_0, y_0, beta, old_solution.head(kept + 1))
+
+    def resume(self, x_0, y_0, beta, checkpoint):
+        # finishes a solve that was interrupted, from the trajectory saved in
+        # the checkpoint file by solve(..., checkpoint=checkpoint)
+        if not self.splines:
+            self.fit()
+        return self.continue_solve(x_0, y_0, beta, Solver.Solution.load(checkpoint), checkpoint)
+
+    def solve_many(self, x_0, y_0, betas):
+        if not self.splines:
+            self.fit()
+        p, z, s = self.splines["p"], self.splines["z"], self.splines["s"]
+        betas = np.asarray(betas, dtype=float)
+        f_func = f_function.FFunction([betas, s, z, self.N])
+        c1, c2, x_ans, y_ans = Solver.solve_many(x_0, y_0, betas, self.T, self.N, p, z, s, self.integral_p, f_func)
+        return c1, c2
+
+    def export(self, directory=None, answers_directory=".", binary=False):
+        # the files the previous versions wrote on every run, as text or as .npy
+        directory = self.directory if directory is None else directory
+        extension = storage.BINARY_EXTENSION if binary else ""
+        os.makedirs(directory, exist_ok=True)
+        for name, (x, values) in self.tables.items():
+            storage.write_table(os.path.join(directory, name + "_func_tabulated" + extension), x, values)
+        for name in self.splines if self.splines else ():
+            x, values = self.interpolated_table(name)
+            storage.write_table(os.path.join(directory, name + "_func_interp_tabulated" + extension), x, values)
+        if self.solution is not None:
+            Solver.print_solution(self.solution.x, self.solution.y, self.solution.t, answers_directory, binary)
@@ -0,0 +1,106 @@
+import argparse
+import json
+import math
+import time
+import pipeline
+
+# Picks the grid size from a target accuracy instead of a fixed N.
+# The whole pipeline (tabulation grid, splines, RK steps) is solved at
+# N, 2N, 4N, ...; for every quantity q the observed order is
+#   p = log2(|q_N - q_2N| / |q_2N - q_4N|)
+# and the Richardson estimate of the error at 2N is |q_2N - q_N| / (2^p - 1).
+# p is capped at the nominal order of the scheme, and doubling stops only when
+# two levels in a row are within tol: a trajectory that crosses y = 0, where u
+# has a jump, converges irregularly and one lucky level must not end the search.
+# The first of the two, the cheapest N that meets tol, is the one chosen.
+
+QUANTITIES = ("x_T", "c1", "c2")
+
+
+def solve_level(a, b, c, d, x_0, y_0, beta, T, calculating_mod, N, method="rk4"):
+    start = time.perf_counter()
+    run = pipeline.Pipeline(a, b, c, d, T, calculating_mod, N).fit()
+    fitted = time.perf_counter()
+    c1, c2 = run.solve(x_0, y_0, beta, method=method)
+    solved = time.perf_counter()
+    stats = run.solution.stats or {}
+    level = {"N": N, "x_T": float(run.solution.x[-1]), "c1": float(c1), "c2": float(c2),
+             "steps": len(run.solution.t) - 1, "evaluations": stats.get("evaluations"),
+             "fit_seconds": fitted - start, "solve_seconds": solved - fitted}
+    return level, run
+
+
+def observed_order(coarse, middle, fine, default):
+    # falls back to the nominal order when the differences are at round-off
+    # level or do not decrease
+    first, second = abs(coarse - middle), abs(middle - fine)
+    if second == 0 or first <= second:
+        return default
+    return min(math.log2(first / second), default)
+
+
+def estimate(levels, order):
+    # orders and error estimates of the last level for every quantity
+    orders, errors = {}, {}
+    for name in QUANTITIES:
+        values = [level[name] for level in levels]
+        p = observed_order(*values[-3:], order) if len(values) >= 3 else order
+        orders[name] = p
+        errors[name] = abs(values[-1] - values[-2]) / (2 ** p - 1)
+    return orders, errors
+
+
+def auto_resolution(a, b, c, d, x_0, y_0, beta, T, calculating_mod, tol=1e-6, N=50,
+                    max_N=50 * 2**8, method="rk4", order=4):
+    # returns (pipeline solved at the chosen N, report); the report lists every
+    # level with its values, evaluation counts and timings. Without
+    # convergence the finest level tried is returned.
+    levels, runs = [], []
+    while True:
+        level, run = solve_level(a, b, c, d, x_0, y_0, beta, T, calculating_mod, N, method)
+        levels.append(level)
+        runs.append(run)
+        if len(levels) >= 2:
+            orders, errors = estimate(levels, order)
+            level["order"], level["error"] = orders, errors
+            passed = [max(level["error"].values()) <= tol for level in levels[2:]]
+            if len(passed) >= 2 and passed[-1] and passed[-2]:
+                converged = True
+                break
+        if 2 * N > max_N:
+            converged = False
+            break
+        N *= 2
+
+    last = levels[-1]
+    extrapolated = {}
+    if "order" in last:
+        for name in QUANTITIES:
+            p = last["order"][name]
+            extrapolated[name] = last[name] + (last[name] - levels[-2][name]) / (2 ** p - 1)
+    chosen = -2 if converged else -1
+    report = {"tol": tol, "converged": converged, "N": levels[chosen]["N"], "levels": levels,
+              "extrapolated": extrapolated,
+              "total_seconds": sum(level["fit_seconds"] + level["solve_seconds"] for level in levels)}
+    return runs[chosen], report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve with the grid size chosen for a target accuracy")
+    for name in ("a", "b", "c", "d", "x_0", "y_0", "beta", "T"):
+        parser.add_argument("--" + name, type=float, required=True)
+    parser.add_argument("--files", action="store_true", help="read p, z, s from tabulated_functions/")
+    parser.add_argument("--tol", type=float, default=1e-6)
+    parser.add_argument("-N", type=int, default=50, help="coarsest level")
+    parser.add_argument("--max-N", type=int, default=50 * 2**8)
+    parser.add_argument("--method", choices=["rk4", "rk45"], default="rk4")
+    args = parser.parse_args(argv)
+
+    run, report = auto_resolution(args.a, args.b, args.c, args.d, args.x_0, args.y_0, args.beta, args.T,
+                                  "Ручной+файл" if args.files else "Ручной", args.tol, args.N, args.max_N,
+                                  args.method, 4 if args.method == "rk4" else 5)
+    print(json.dumps(report, indent=2, default=float))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pipeline
+
+# Local solve service: one JSON object per line over TCP (or a Unix socket).
+#
+#   {"id": 1, "a": 1, "b": 2, "c": 1, "d": 1, "x_0": 0.5, "y_0": 0.1, "beta": 1.3, "T": 1}
+#   -> {"id": 1, "c1": ..., "c2": ..., "x_T": ..., "y_T": ...}
+#   {"id": 2, "op": "metrics"} -> latency percentiles, throughput and counters
+#
+# Optional request fields: "N" (50), "method" ("rk4"), "mode" ("Ручной"), and
+# "p", "z", "s" as expressions, see pipeline.user_functions, e.g.
+#   "z": {"expression": "k * t + cos(t)", "params": {"k": 2}};
+# a and b are then optional without p, c without z and d without s.
+# Solves run on a process pool whose workers keep fitted pipelines warm, so a
+# repeated (a, b, c, d, T, N) skips tabulation and the spline fit; each warm
+# pipeline remembers its last WARM_RESULTS solves. Identical requests in
+# flight share one solve. At most `pending` solves are queued on the pool;
+# past that, requests wait, and past `backlog` waiting ones they are refused
+# with {"error": "overloaded"}.
+#
+#   python -m service serve --port 8765 --workers 4
+#   python -m service load --port 8765 --requests 2000 --concurrency 64 --distinct 100
+
+SCENARIO = ("a", "b", "c", "d", "x_0", "y_0", "beta", "T")
+# the function each coefficient belongs to
+COEFFICIENTS = {"a": "p", "b": "p", "c": "z", "d": "s"}
+WARM_PIPELINES = 32
+# solves remembered per warm pipeline
+WARM_RESULTS = 16
+
+warm = collections.OrderedDict()
+
+
+def request_key(message):
+    specs = {name: message[name] for name in pipeline.FUNCTION_NAMES if name in message}
+    values = tuple(None if name not in message and COEFFICIENTS.get(name, "") in specs else float(message[name])
+                   for name in SCENARIO)
+    # bad expressions are refused here rather than in a worker
+    pipeline.user_functions(specs, *values[:4])
+    return values + (int(message.get("N", 50)), message.get("method", "rk4"), message.get("mode", "Ручной"),
+                     json.dumps(specs, sort_keys=True))
+
+
+def solve_in_worker(key):
+    # runs in a pool process; the fitted pipelines stay in `warm` between calls
+    a, b, c, d, x_0, y_0, beta, T, N, method, mode, specs = key
+    inputs = (a, b, c, d, T, N, mode, specs)
+    if inputs in warm:
+        warm.move_to_end(inputs)
+        run = warm[inputs]
+    else:
+        run = warm[inputs] = pipeline.Pipeline(a, b, c, d, T, mode, N, functions=pipeline.user_functions(
+            json.loads(specs), a, b, c, d)).fit()
+        while len(warm) > WARM_PIPELINES:
+            warm.popitem(last=False)
+    # run.results memoizes whole trajectories; kept as an LRU of WARM_RESULTS
+    key = (x_0, y_0, beta, method, ())
+    if key in run.results:
+        run.results[key] = run.results.pop(key)
+    c1, c2 = run.solve(x_0, y_0, beta, method=method)
+    while len(run.results) > WARM_RESULTS:
+        del run.results[next(iter(run.results))]
+    return {"c1": float(c1), "c2": float(c2),
+            "x_T": float(run.solution.x[-1]), "y_T": float(run.solution.y[-1])}
+
+
+class Metrics():
+
+    def __init__(self, window=10000):
+        self.latencies = collections.deque(maxlen=window)
+        self.finished = collections.deque(maxlen=window)
+        self.counters = collections.Counter()
+        self.started = time.monotonic()
+
+    def record(self, latency):
+        self.latencies.append(latency)
+        self.finished.append(time.monotonic())
+
+    def report(self):
+        report = dict(self.counters)
+        report["uptime"] = time.monotonic() - self.started
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1e3
+            for q in (50, 90, 99):
+                report["p{}_ms".format(q)] = float(np.percentile(latencies, q))
+            report["max_ms"] = float(latencies.max())
+        if len(self.finished) > 1:
+            span = self.finished[-1] - self.finished[0]
+            report["throughput"] = (len(self.finished) - 1) / span if span > 0 else None
+        return report
+
+
+class SolveService():
+
+    def __init__(self, workers=None, pending=None, backlog=1000):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.slots = asyncio.Semaphore(pending or 2 * self.workers)
+        self.backlog = backlog
+        self.waiting = 0
+        self.in_flight = {}
+        self.metrics = Metrics()
+
+    async def solve(self, key):
+        if key in self.in_flight:
+            self.metrics.counters["coalesced"] += 1
+            return await asyncio.shield(self.in_flight[key])
+        if self.waiting >= self.backlog:
+            self.metrics.counters["rejected"] += 1
+            raise OverflowError("overloaded")
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            self.waiting += 1
+            try:
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                self.metrics.counters["solves"] += 1
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, solve_in_worker, key)
+            finally:
+                self.slots.release()
+            future.set_result(result)
+        except BaseException as error:
+            future.set_exception(error)
+            # the waiters get the exception; this keeps asyncio from
+            # reporting it as never retrieved when there are none
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+        return result
+
+    async def respond(self, message):
+        start = time.perf_counter()
+        self.metrics.counters["requests"] += 1
+        response = {"id": message.get("id")}
+        try:
+            if message.get("op", "solve") == "metrics":
+                response.update(self.metrics.report())
+                return response
+            response.update(await self.solve(request_key(message)))
+            self.metrics.record(time.perf_counter() - start)
+        except OverflowError as error:
+            response["error"] = str(error)
+        except (KeyError, TypeError, ValueError) as error:
+            self.metrics.counters["errors"] += 1
+            response["error"] = "bad request: {!r}".format(error)
+        except Exception as error:
+            self.metrics.counters["errors"] += 1
+            response["error"] = "{}: {}".format(type(error).__name__, error)
+        return response
+
+    async def handle(self, reader, writer):
+        # requests on one connection are answered as they finish, not in order
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def answer(line):
+            try:
+                message = json.loads(line)
+                if not isinstance(message, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as error:
+                response = {"id": None, "error": "bad request: {}".format(error)}
+            else:
+                response = await self.respond(message)
+            async with lock:
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(answer(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+async def serve(host="127.0.0.1", port=8765, path=None, workers=None, pending=None, backlog=1000):
+    service = SolveService(workers, pending, backlog)
+    if path is not None:
+        server = await asyncio.start_unix_server(service.handle, path)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    print("serving on {} with {} workers".format(path or "{}:{}".format(host, port), service.workers),
+          file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+async def connect(host="127.0.0.1", port=8765, path=None):
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(host, port)
+
+
+async def load_test(host="127.0.0.1", port=8765, path=None, requests=1000, concurrency=32, distinct=50, seed=0):
+    # `concurrency` connections send `requests` solves in total, drawn from
+    # `distinct` scenarios so that the warm pipelines and coalescing are hit
+    rng = np.random.default_rng(seed)
+    scenarios = [{"a": 1.0, "b": 2.0, "c": float(c), "d": 1.0, "x_0": 0.5, "y_0": 0.1,
+                  "beta": float(beta), "T": 1.0}
+                 for c, beta in zip(rng.choice([0.5, 1.0, 1.5, 2.0], distinct), rng.uniform(0.1, 3.0, distinct))]
+    order = rng.integers(0, distinct, requests)
+    latencies, errors = [], collections.Counter()
+    counter = iter(range(requests))
+
+    async def client():
+        reader, writer = await connect(host, port, path)
+        try:
+            for i in counter:
+                message = dict(scenarios[order[i]], id=i)
+                start = time.perf_counter()
+                writer.write((json.dumps(message) + "\n").encode())
+                await writer.drain()
+                response = json.loads(await reader.readline())
+                latencies.append(time.perf_counter() - start)
+                if "error" in response:
+                    errors[response["error"]] += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await connect(host, port, path)
+    writer.write(b'{"id": "metrics", "op": "metrics"}\n')
+    await writer.drain()
+    server = json.loads(await reader.readline())
+    writer.close()
+
+    latencies = np.array(latencies) * 1e3
+    return {"requests": requests, "concurrency": concurrency, "distinct": distinct,
+            "seconds": elapsed, "throughput": requests / elapsed,
+            "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()), "errors": dict(errors), "server": server}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local solve service and its load-test client")
+    parser.add_argument("command", choices=["serve", "load"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="Unix socket path instead of TCP")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--pending", type=int, default=None, help="solves queued on the pool at once")
+    parser.add_argument("--backlog", type=int, default=1000, help="waiting requests before refusing")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--distinct", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port, args.unix, args.workers, args.pending, args.backlog))
+        except KeyboardInterrupt:
+            pass
+    else:
+        report = asyncio.run(load_test(args.host, args.port, args.unix, args.requests, args.concurrency, args.distinct))
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pipeline
+from functions import interpolated_function, p_function, s_function, z_function
+
+PARAMETERS = ("a", "b", "c", "d", "x_0", "y_0", "beta", "T")
+RESULT_DTYPE = np.dtype([(name, float) for name in PARAMETERS] +
+                        [("c1", float), ("c2", float), ("x_T", float), ("y_T", float)])
+# the analytic functions and the scenario parameters each of them depends on
+FUNCTIONS = {"p": (p_function.PFunction, ("a", "b")), "z": (z_function.ZFunction, ("c",)),
+             "s": (s_function.SFunction, ("d",))}
+
+
+def grid(**values):
+    # grid(a=[1, 2], b=[2], ...) -> list of scenarios, one per combination
+    names = [name for name in PARAMETERS if name in values]
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+def solve_scenario(scenario, calculating_mod="Ручной", N=50, functions=None):
+    # a fresh in-memory pipeline per scenario, nothing is written to disk
+    run = pipeline.Pipeline(scenario["a"], scenario["b"], scenario["c"], scenario["d"],
+                            scenario["T"], calculating_mod, N, functions=functions)
+    c1, c2 = run.solve(scenario["x_0"], scenario["y_0"], scenario["beta"])
+    return tuple(scenario[name] for name in PARAMETERS) + (c1, c2, run.solution.x[-1], run.solution.y[-1])
+
+
+def batch_splines(scenarios, N):
+    # The p, z, s splines of all the scenarios, fitted per T with one
+    # SplineBatch per function: the tables of one T share the grid. p depends
+    # on (a, b), z on c and s on d, so every distinct table is fitted once.
+    splines = [{} for _ in scenarios]
+    for T in set(scenario["T"] for scenario in scenarios):
+        grid = np.linspace(0, T, N + 1)
+        indices = [i for i, scenario in enumerate(scenarios) if scenario["T"] == T]
+        for name, (function_class, parameters) in FUNCTIONS.items():
+            keys = [tuple(scenarios[i][parameter] for parameter in parameters) for i in indices]
+            distinct = sorted(set(keys))
+            tables = [function_class(list(key)).calculate_many(grid) for key in distinct]
+            batch = interpolated_function.SplineBatch(grid, tables)
+            fitted = {key: batch.spline(k) for k, key in enumerate(distinct)}
+            for i, key in zip(indices, keys):
+                splines[i][name] = fitted[key]
+    return splines
+
+
+def solve_chunk(scenarios, calculating_mod, N):
+    if calculating_mod != "Ручной":
+        return [solve_scenario(scenario, calculating_mod, N) for scenario in scenarios]
+    return [solve_scenario(scenario, calculating_mod, N, functions)
+            for scenario, functions in zip(scenarios, batch_splines(scenarios, N))]
+
+
+def sweep(scenarios, workers=None, chunk_size=None, calculating_mod="Ручной", N=50):
+    # solves the scenarios on a process pool, returns a structured array
+    # in the order of the scenarios
+    scenarios = list(scenarios)
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, len(scenarios) // (workers * 4))
+    chunks = [scenarios[i:i + chunk_size] for i in range(0, len(scenarios), chunk_size)]
+
+    rows = []
+    if workers == 1:
+        for chunk in chunks:
+            rows.extend(solve_chunk(chunk, calculating_mod, N))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for result in executor.map(solve_chunk, chunks, itertools.repeat(calculating_mod), itertools.repeat(N)):
+                rows.extend(result)
+    return np.array(rows, dtype=RESULT_DTYPE)
+
+
+def write_results(results, filename):
+    if filename.endswith(".npy"):
+        np.save(filename, results)
+        return
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(results.dtype.names)
+        for row in results:
+            writer.writerow(row.tolist())
+
+
+def parse_values(text):
+    # "1,2,3" -> [1, 2, 3]; "start:stop:count" -> np.linspace(start, stop, count)
+    if ':' in text:
+        start, stop, count = text.split(':')
+        return np.linspace(float(start), float(stop), int(count)).tolist()
+    return [float(value) for value in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep over (a, b, c, d, x_0, y_0, beta, T)")
+    for name in PARAMETERS:
+        parser.add_argument("--" + name, required=True, type=parse_values,
+                            help="comma separated values or start:stop:count")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("-N", type=int, default=50)
+    parser.add_argument("--output", default="sweep.csv", help=".csv or .npy")
+    args = parser.parse_args(argv)
+
+    scenarios = grid(**{name: getattr(args, name) for name in PARAMETERS})
+    results = sweep(scenarios, args.workers, args.chunk_size, N=args.N)
+    write_results(results, args.output)
+    print("{} scenarios -> {}".format(len(results), args.output))
+
+
+if __name__ == '__main__':
+    main()
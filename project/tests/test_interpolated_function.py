@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+from functions import interpolated_function, storage
+from functions.interpolated_function import InterpolatedFunction, SplineBatch
+
+BOUNDARY_CONDITIONS = [("natural", (0.0, 0.0)), ("clamped", (0.3, -0.8)), ("not-a-knot", (0.0, 0.0))]
+
+
+def dense(lower, diag, upper):
+    return np.diag(diag) + np.diag(lower[1:], -1) + np.diag(upper[:-1], 1)
+
+
+@pytest.mark.parametrize("n", [1, 5, 16, 17, 100, 1025])
+@pytest.mark.parametrize("columns", [None, 3])
+def test_solve_tridiagonal_matches_dense_solve(n, columns):
+    rng = np.random.default_rng(n)
+    lower, upper = rng.uniform(-1, 1, n), rng.uniform(-1, 1, n)
+    diag = 4 + rng.uniform(0, 1, n)
+    rhs = rng.normal(size=n if columns is None else (n, columns))
+    expected = np.linalg.solve(dense(lower, diag, upper), rhs)
+    assert np.allclose(interpolated_function.solve_tridiagonal(lower, diag, upper, rhs), expected,
+                       rtol=1e-12, atol=1e-12)
+
+
+def knots(n=40, seed=0):
+    x = np.sort(np.random.default_rng(seed).uniform(0, 3, n))
+    return x, np.sin(2 * x) + x
+
+
+@pytest.mark.parametrize("bc_type, bc_values", BOUNDARY_CONDITIONS)
+def test_spline_interpolates_and_is_twice_continuous(bc_type, bc_values):
+    x, y = knots()
+    spline = InterpolatedFunction(None, (x, y), bc_type, bc_values)
+    assert np.allclose(spline.calculate_many(x), y, rtol=0, atol=1e-12)
+    # at x_i segment i ends (dx = 0) and segment i + 1 starts (dx = -h_{i+1})
+    a, b, c, d = spline.coeffs
+    h = np.diff(x)[1:]
+    right = [a[2:] - b[2:] * h + c[2:] * h ** 2 - d[2:] * h ** 3,
+             b[2:] - 2 * c[2:] * h + 3 * d[2:] * h ** 2,
+             2 * c[2:] - 6 * d[2:] * h]
+    for left, right in zip([a[1:-1], b[1:-1], 2 * c[1:-1]], right):
+        assert np.allclose(left, right, rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("bc_type, bc_values", BOUNDARY_CONDITIONS)
+def test_end_conditions(bc_type, bc_values):
+    x, y = knots()
+    spline = InterpolatedFunction(None, (x, y), bc_type, bc_values)
+    ends = x[[0, -1]]
+    if bc_type == "natural":
+        assert np.allclose(spline.derivative(2).calculate_many(ends), 0, atol=1e-9)
+    elif bc_type == "clamped":
+        assert np.allclose(spline.derivative().calculate_many(ends), bc_values, atol=1e-9)
+    else:
+        # the third derivative does not jump at the second and the last but one knot
+        d = spline.d
+        assert np.isclose(d[1], d[2], rtol=1e-9) and np.isclose(d[-1], d[-2], rtol=1e-9)
+
+
+@pytest.mark.parametrize("bc_type, bc_values", BOUNDARY_CONDITIONS)
+def test_constant_left_of_first_knot_and_outside_past_last(bc_type, bc_values):
+    x, y = knots()
+    spline = InterpolatedFunction(None, (x, y), bc_type, bc_values)
+    assert np.allclose(spline.calculate_many(x[0] - np.array([0.1, 1.0, 5.0])), y[0], rtol=0, atol=0)
+    assert spline.calculate(x[-1] + 1) == spline.outside
+
+
+@pytest.mark.parametrize("bc_type, bc_values", BOUNDARY_CONDITIONS)
+def test_streamed_fit_matches_in_memory_fit(tmp_path, bc_type, bc_values):
+    x = np.linspace(0, 2, 5001)
+    y = np.cos(3 * x)
+    table = str(tmp_path / "table.npy")
+    storage.write_table(table, x, y)
+    streamed = InterpolatedFunction.stream(table, str(tmp_path / "spline.npy"), chunk=256,
+                                           bc_type=bc_type, bc_values=bc_values)
+    in_memory = InterpolatedFunction(None, (x, y), bc_type, bc_values)
+    for mine, theirs in zip(streamed.coeffs, in_memory.coeffs):
+        assert np.allclose(mine, theirs, rtol=1e-10, atol=1e-10)
+    points = np.linspace(-0.5, 2.5, 1001)
+    assert np.allclose(streamed.calculate_many(points), in_memory.calculate_many(points), rtol=0, atol=1e-12)
+
+
+def test_streaming_a_text_table_does_not_hide_it(tmp_path):
+    x = np.linspace(0, 1, 101)
+    table = str(tmp_path / "table")
+    storage.write_table(table, x, x ** 2)
+    assert np.isclose(InterpolatedFunction.stream(table, str(tmp_path / "spline.npy")).calculate(0.5), 0.25)
+    storage.write_table(table, x, 10 + x)
+    assert np.isclose(InterpolatedFunction.stream(table, str(tmp_path / "spline.npy")).calculate(0.5), 10.5)
+    assert np.isclose(storage.read_table(table)[1][50], 10.5)
+
+
+@pytest.mark.parametrize("bc_type, bc_values", BOUNDARY_CONDITIONS)
+@pytest.mark.parametrize("n", [2, 3, 4, 60])
+def test_spline_batch_matches_per_table_fits(bc_type, bc_values, n):
+    x = np.linspace(0, 3, n)
+    tables = np.array([np.sin(k * x) + k for k in range(5)])
+    batch = SplineBatch(x, tables, bc_type, bc_values)
+    points = np.linspace(-0.5, 3.5, 333)
+    values = batch.calculate_many(points)
+    for k, table in enumerate(tables):
+        single = InterpolatedFunction(None, (x, table), bc_type, bc_values)
+        assert np.array_equal(values[k], single.calculate_many(points))
+        assert np.array_equal(batch.spline(k).calculate_many(points), single.calculate_many(points))
+    assert batch.calculate_many(points.reshape(9, 37), [1, 3]).shape == (2, 9, 37)
+
+
+def test_spline_batch_takes_one_pair_of_end_values_per_table():
+    x = np.linspace(0, 1, 30)
+    tables = [x ** 2, np.exp(x)]
+    batch = SplineBatch(x, tables, "clamped", [(0.0, 2.0), (1.0, np.e)])
+    for k, (table, bc_values) in enumerate(zip(tables, [(0.0, 2.0), (1.0, np.e)])):
+        single = InterpolatedFunction(None, (x, table), "clamped", bc_values)
+        assert np.array_equal(batch.calculate_many(x, k), single.calculate_many(x))
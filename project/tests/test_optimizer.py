@@ -0,0 +1,14 @@
+import pytest
+import optimizer
+
+
+@pytest.mark.parametrize("method", ["brent", "golden"])
+@pytest.mark.parametrize("left, right", [(0.0, 3.0), (3.0, 0.0)])
+def test_minimize_finds_the_minimum_in_either_bracket_order(method, left, right):
+    x, fx, evaluations = optimizer.minimize(lambda x: (x - 1) ** 2, left, right, 1e-8, method)
+    assert abs(x - 1) < 1e-6
+
+
+def test_minimize_rejects_an_empty_bracket():
+    with pytest.raises(ValueError):
+        optimizer.minimize(lambda x: x ** 2, 1.0, 1.0)
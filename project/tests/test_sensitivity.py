@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+import pipeline
+
+PARAMS = {"a": 1.0, "b": 2.0, "c": 1.0, "d": 1.0}
+X_0, Y_0, BETA, T, N = 0.5, 0.1, 1.3, 1.0, 50
+STEP = 1e-5
+
+
+def criteria(params, beta):
+    return np.array(pipeline.Pipeline(*params.values(), T, "Ручной", N).solve(X_0, Y_0, beta))
+
+
+@pytest.mark.parametrize("wrt", ["beta", "a", "b", "c", "d"])
+def test_sensitivities_match_central_differences(wrt):
+    run = pipeline.Pipeline(*PARAMS.values(), T, "Ручной", N)
+    c1, c2, dc1, dc2 = run.gradient(X_0, Y_0, BETA, wrt)
+    assert np.allclose([c1, c2], criteria(PARAMS, BETA), rtol=0, atol=1e-12)
+    if wrt == "beta":
+        forward, backward = criteria(PARAMS, BETA + STEP), criteria(PARAMS, BETA - STEP)
+    else:
+        forward = criteria(dict(PARAMS, **{wrt: PARAMS[wrt] + STEP}), BETA)
+        backward = criteria(dict(PARAMS, **{wrt: PARAMS[wrt] - STEP}), BETA)
+    assert np.allclose([dc1, dc2], (forward - backward) / (2 * STEP), rtol=0, atol=1e-8)
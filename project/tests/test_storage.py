@@ -0,0 +1,37 @@
+import os
+import numpy as np
+import pipeline
+from functions import storage
+
+
+def test_newer_text_table_wins_over_older_binary(tmp_path):
+    table = str(tmp_path / "table")
+    x = np.linspace(0, 1, 5)
+    storage.write_table(table + storage.BINARY_EXTENSION, x, x ** 2)
+    storage.write_table(table, x, 10 + x)
+    os.utime(table + storage.BINARY_EXTENSION, ns=(1, 1))
+    assert storage.find_table(table) == table
+    assert np.allclose(storage.read_table(table)[1], 10 + x)
+
+
+def test_mapped_conversion_is_rebuilt_and_counts_rows(tmp_path):
+    table = str(tmp_path / "table")
+    x = np.linspace(0, 1, 7)
+    storage.write_table(table, x, x ** 2)
+    converted = storage.mapped(table)
+    assert storage.count_rows(table) == storage.count_rows(converted) == 7
+    storage.write_table(table, x, 10 + x)
+    os.utime(converted, ns=(1, 1))
+    assert np.allclose(storage.read_table(storage.mapped(table))[1], 10 + x)
+    assert storage.find_table(table) == table
+    assert not [name for name in os.listdir(os.path.dirname(converted)) if ".tmp" in name]
+
+
+def test_file_mode_leaves_the_input_directory_alone(tmp_path):
+    t = np.linspace(0, 1, 101)
+    for name, values in (("p", t * (2 - t)), ("z", t + np.cos(t)), ("s", t + np.sin(t))):
+        storage.write_table(str(tmp_path / (name + "_func_tabulated")), t, values)
+    before = sorted(os.listdir(tmp_path))
+    run = pipeline.Pipeline(1, 2, 1, 1, 1, "Ручной+файл", 50, directory=str(tmp_path))
+    run.solve(0.5, 0.1, 1.3)
+    assert sorted(os.listdir(tmp_path)) == before